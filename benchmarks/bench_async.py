@@ -0,0 +1,64 @@
+"""Throughput of AsyncKomootApi against the local mock server.
+
+    python benchmarks/bench_async.py --tours 500 --latency 0.05 --concurrency 100
+
+Lists all tours, then fetches every tour, its images and all highlight tips
+from a single event loop and reports requests per second.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from komootgpx.asyncapi import AsyncKomootApi  # noqa: E402
+from mock_server import DISPLAY_NAME, TOKEN, USER_ID, add_config_arguments, config_from_args, serve  # noqa: E402
+
+
+async def sync_account(api, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(coro):
+        async with semaphore:
+            return await coro
+
+    tours = await api.fetch_tours(silent=True)
+    details = await asyncio.gather(*(limited(api.fetch_tour(str(tour_id))) for tour_id in tours))
+    await asyncio.gather(*(limited(api.fetch_tour_images(str(tour_id), silent=True)) for tour_id in tours))
+
+    highlight_ids = {str(item["_embedded"]["reference"]["id"])
+                     for tour in details
+                     for item in tour["_embedded"]["timeline"]["_embedded"]["items"]}
+    await asyncio.gather(*(limited(api.fetch_highlight_tips(hid)) for hid in highlight_ids))
+
+
+async def run(args):
+    server = serve(config_from_args(args))
+    try:
+        async with AsyncKomootApi(base_url=server.url, max_connections=args.concurrency) as api:
+            api.login_with_token(USER_ID, TOKEN, DISPLAY_NAME)
+            start = time.perf_counter()
+            # the client reports progress per request, which would dominate the measurement
+            with contextlib.redirect_stdout(io.StringIO()):
+                await sync_account(api, args.concurrency)
+            elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    print(f"{api.request_count} requests in {elapsed:.2f}s = {api.request_count / elapsed:.1f} req/s "
+          f"(concurrency {args.concurrency}, latency {args.latency * 1000:.0f}ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=50, help="Maximum requests in flight")
+    add_config_arguments(parser)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""End-to-end sync time of komootgpx against the local mock server.
+
+    python benchmarks/bench_e2e.py --tours 10000 --latency 0.02 -- --jobs 8
+
+Runs a full `--make-all --add-images` export through entrypoint(), with a
+throwaway cache and output directory, and reports requests per second and
+total sync time. Arguments after "--" are passed on to komootgpx.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mock_server import add_config_arguments, config_from_args, serve  # noqa: E402
+
+
+def run(args, extra_args, workdir):
+    # komootgpx resolves its cache directory once per process on first use, so XDG_CACHE_HOME must be set before
+    os.environ["XDG_CACHE_HOME"] = os.path.join(workdir, "cache")
+    # run in an empty directory, a config.yaml in the working directory would be picked up
+    os.chdir(workdir)
+    from komootgpx.komootgpx import entrypoint
+
+    server = serve(config_from_args(args))
+    argv = ["komootgpx", "--api-url", server.url, "-m", "bench@example.com", "-p", "bench",
+            "--make-all", "--add-images", "--output", os.path.join(workdir, "out")] + extra_args
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            sys.argv = argv
+            entrypoint()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    mock = server.mock
+    return {
+        "tours": args.tours,
+        "images_per_tour": args.images,
+        "latency": args.latency,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "komootgpx_args": extra_args,
+        "requests": mock.request_count,
+        "errors": mock.error_count,
+        "throttled": mock.throttle_count,
+        "seconds": elapsed,
+        "requests_per_sec": mock.request_count / elapsed,
+        "tours_per_sec": args.tours / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    add_config_arguments(parser)
+    argv = sys.argv[1:]
+    extra_args = []
+    if "--" in argv:
+        extra_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="komootgpx-bench-") as workdir:
+        cwd = os.getcwd()
+        try:
+            result = run(args, extra_args, workdir)
+        finally:
+            os.chdir(cwd)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['requests']} requests ({result['errors']} failed, {result['throttled']} throttled) "
+              f"in {result['seconds']:.2f}s = "
+              f"{result['requests_per_sec']:.1f} req/s, {result['tours_per_sec']:.1f} tours/s "
+              f"({args.tours} tours, {args.images} images each, latency {args.latency * 1000:.0f}ms)")
+
+
+if __name__ == "__main__":
+    main()
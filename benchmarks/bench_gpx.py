@@ -0,0 +1,172 @@
+"""Micro-benchmarks of the GPX compilation hot path on synthetic tours.
+
+    python benchmarks/bench_gpx.py --sizes 1000,100000 --output results.json
+
+Times response decoding, coordinate parsing, GpxCompiler construction and
+generate() for tours with and without times/elevation, plus filename
+templating, against a stub API. Results are printed as JSON, so runs can be compared between releases.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from komootgpx import fastjson  # noqa: E402
+from komootgpx.__version__ import __version__  # noqa: E402
+from komootgpx.gpxcompiler import GpxCompiler, Route  # noqa: E402
+from komootgpx.komootgpx import format_tour_filename  # noqa: E402
+
+
+class StubApi:
+    # stands in for KomootApi, GpxCompiler only looks up highlight tips
+    def fetch_highlight_tips(self, highlight_id):
+        return {"_embedded": {"items": [
+            {"text": f"Tip {k} for highlight {highlight_id}", "_embedded": {"creator": {"display_name": "Tipper"}}}
+            for k in range(3)
+        ]}}
+
+
+def make_items(points, with_time, with_alt):
+    items = []
+    for k in range(points):
+        item = {"lat": 47.0 + k * 1e-6, "lng": 11.0 + k * 1.3e-6}
+        if with_alt:
+            item["alt"] = 500.0 + (k % 1000) * 0.25
+        if with_time:
+            item["t"] = k * 1000
+        items.append(item)
+    return items
+
+
+def make_timeline(pois):
+    # highlights, POIs and categorized points in equal parts
+    timeline = []
+    for k in range(pois):
+        location = {"lat": 47.0 + k * 1e-4, "lng": 11.0 + k * 1e-4, "alt": 600.0}
+        if k % 3 == 0:
+            timeline.append({"type": "highlight", "_embedded": {"reference": {
+                "id": 5000 + k, "name": f"Highlight {k}", "mid_point": location,
+                "_embedded": {"front_image": {"src": f"https://example.com/hl/{k}.jpg?width=200"}},
+            }}})
+        elif k % 3 == 1:
+            timeline.append({"type": "poi", "_embedded": {"reference": {
+                "name": f"POI {k}", "location": location, "details": [{"formatted": "Drinking water"}],
+            }}})
+        else:
+            timeline.append({"type": "point", "_embedded": {"reference": {
+                "name": f"Point {k}", "category": k % 10, "location": location, "description": "Description " * 5,
+            }}})
+    return timeline
+
+
+def make_tour(points, with_time, with_alt, pois):
+    return {
+        "id": 100000,
+        "name": "Benchmark tour",
+        "type": "tour_recorded" if with_time else "tour_planned",
+        "sport": "hike",
+        "date": "2024-05-01T08:00:00.000+02:00",
+        "changed_at": "2024-05-02T10:00:00.000Z",
+        "distance": 12345.6,
+        "duration": 7200,
+        "elevation_up": 420,
+        "elevation_down": 410,
+        "difficulty": {"grade": "moderate"},
+        "_embedded": {
+            "coordinates": {"items": make_items(points, with_time, with_alt)},
+            "creator": {"display_name": "Bench User", "username": "1000000000"},
+            "timeline": {"_embedded": {"items": make_timeline(pois)}},
+        },
+    }
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": statistics.median(timings)}
+
+
+def bench_tour(points, with_time, with_alt, pois, repeat):
+    tour = make_tour(points, with_time, with_alt, pois)
+    items = tour["_embedded"]["coordinates"]["items"]
+    api = StubApi()
+    compiler = GpxCompiler(tour, api)
+    body = json.dumps(tour, separators=(",", ":")).encode("utf-8")
+
+    results = {}
+    # decoding a tour response: into dicts and then columns, or straight into columns
+    results["decode_dicts"] = measure(
+        lambda: Route.from_items(fastjson.loads(body)["_embedded"]["coordinates"]["items"]), repeat)
+    results["decode"] = measure(lambda: fastjson.decode_tour(body), repeat)
+    results["parse"] = measure(lambda: Route.from_items(items), repeat)
+    results["init"] = measure(lambda: GpxCompiler(tour, api), repeat)
+    results["generate"] = measure(compiler.generate, repeat)
+    for timing in results.values():
+        timing["points_per_sec"] = points / timing["min"] if timing["min"] else None
+    return results
+
+
+def bench_filenames(count, repeat):
+    tours = [make_tour(0, False, False, 0) for _ in range(count)]
+    for k, tour in enumerate(tours):
+        tour["name"] = f"Tour {k}: over the hills / and far away"
+    patterns = ("{title}-{id}.gpx", "{date}_{title}-{id}_images")
+
+    def run():
+        for k, tour in enumerate(tours):
+            for pattern in patterns:
+                format_tour_filename(pattern, k, tour, -1)
+
+    timing = measure(run, repeat)
+    timing["calls_per_sec"] = count * len(patterns) / timing["min"] if timing["min"] else None
+    return timing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=str, default="1000,100000,1000000", help="Comma separated numbers of coordinates")
+    parser.add_argument("--pois", type=int, default=300, help="Timeline entries (highlights, POIs, points) per tour")
+    parser.add_argument("--filenames", type=int, default=10000, help="Tours used for the filename templating benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per measurement, min and median are reported")
+    parser.add_argument("--json-backend", choices=("orjson", "json"), default=fastjson.BACKEND,
+                        help="JSON backend used to decode tours")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+    fastjson.set_backend(args.json_backend)
+
+    report = {
+        "komootgpx": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "json_backend": fastjson.BACKEND,
+        "repeat": args.repeat,
+        "tours": [],
+    }
+    for points in (int(size) for size in args.sizes.split(",")):
+        for with_time, with_alt in ((True, True), (False, False)):
+            case = {"points": points, "time": with_time, "alt": with_alt, "pois": args.pois}
+            case.update(bench_tour(points, with_time, with_alt, args.pois, args.repeat))
+            report["tours"].append(case)
+            print(f"{points:>8} points, time/alt {'yes' if with_time else 'no ':<3}: "
+                  + ", ".join(f"{name} {case[name]['min'] * 1000:.1f}ms" for name in ("decode_dicts", "decode", "parse", "init", "generate")),
+                  file=sys.stderr)
+    report["filenames"] = bench_filenames(args.filenames, args.repeat)
+    print(f"filename templating: {report['filenames']['calls_per_sec']:.0f} calls/s", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Startup time of the komootgpx CLI, with a guard against import regressions.
+
+    python benchmarks/bench_startup.py --runs 20 --max-ms 150
+
+Times `python -m komootgpx --version` and `--help` in fresh interpreters and
+checks that importing the package loads none of the heavy dependencies.
+Exits with status 1 if a heavy module is imported eagerly or the median
+startup time exceeds --max-ms, so it can run in CI.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# must only be imported once a command actually needs them
+HEAVY_MODULES = ("requests", "urllib3", "gpxpy", "PIL", "piexif", "platformdirs", "configargparse", "sqlite3")
+
+COMMANDS = {
+    "baseline": [sys.executable, "-c", "pass"],
+    "version": [sys.executable, "-m", "komootgpx", "--version"],
+    "help": [sys.executable, "-m", "komootgpx", "--help"],
+}
+
+
+def time_command(command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"min_ms": min(timings), "median_ms": statistics.median(timings)}
+
+
+def eagerly_imported():
+    code = ("import sys, json, komootgpx; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="Interpreter starts per command")
+    parser.add_argument("--max-ms", type=float, default=None, help="Fail if the median --version startup exceeds this")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    result = {name: time_command(command, args.runs) for name, command in COMMANDS.items()}
+    result["eager_imports"] = eagerly_imported()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for name in COMMANDS:
+            print(f"{name:<10} min {result[name]['min_ms']:7.1f}ms  median {result[name]['median_ms']:7.1f}ms")
+
+    failed = False
+    if result["eager_imports"]:
+        print(f"FAIL: importing komootgpx loads {', '.join(result['eager_imports'])}", file=sys.stderr)
+        failed = True
+    if args.max_ms is not None and result["version"]["median_ms"] > args.max_ms:
+        print(f"FAIL: median --version startup {result['version']['median_ms']:.1f}ms exceeds {args.max_ms}ms",
+              file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Local stub of the Komoot API endpoints used by KomootApi and AsyncKomootApi.
+
+Serves a synthetic, deterministic account so throughput can be measured offline:
+
+    python benchmarks/mock_server.py --tours 1000 --latency 0.02
+
+Point a client at it with base_url=<printed url>, or komootgpx with --api-url=<printed url>.
+"""
+import argparse
+import io
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+USER_ID = "1000000000"
+TOKEN = "mock-token"
+DISPLAY_NAME = "Mock User"
+FIRST_TOUR_ID = 100000
+
+
+@dataclass
+class MockConfig:
+    tours: int = 100
+    page_size: int = 24
+    coordinates: int = 1000
+    highlights: int = 10
+    images: int = 4
+    latency: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: int = 1
+    image_size: int = 0
+    seed: int = 0
+
+
+class MockKomoot:
+    def __init__(self, config):
+        self.config = config
+        self.base_url = ""
+        self.request_count = 0
+        self.error_count = 0
+        self.throttle_count = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(config.seed)
+        self._jpeg = None
+
+    def count_request(self):
+        # returns "error" or "throttle" if this request should fail, None otherwise
+        with self._lock:
+            self.request_count += 1
+            draw = self._random.random()
+            if draw < self.config.error_rate:
+                self.error_count += 1
+                return "error"
+            if draw < self.config.error_rate + self.config.throttle_rate:
+                self.throttle_count += 1
+                return "throttle"
+            return None
+
+    def tour_summary(self, index):
+        return {
+            "id": FIRST_TOUR_ID + index,
+            "name": f"Mock tour {index}",
+            "type": "tour_recorded" if index % 2 else "tour_planned",
+            "sport": "hike" if index % 3 else "touringbicycle",
+            "status": "private" if index % 4 else "public",
+            "distance": 10000.0 + index,
+            "duration": 3600 + index,
+            "elevation_up": 100 + index % 500,
+            "elevation_down": 90 + index % 500,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S.000+02:00", time.gmtime(1600000000 + index * 86400)),
+            # most recently changed tours first, like the real API's default sort
+            "changed_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(1700000000 - index * 3600)),
+        }
+
+    def tours_page(self, page):
+        size = self.config.page_size
+        first = page * size
+        last = min(first + size, self.config.tours)
+        body = {"_links": {}, "_embedded": {"tours": [self.tour_summary(i) for i in range(first, last)]}}
+        if last < self.config.tours:
+            body["_links"]["next"] = {"href": f"{self.base_url}/v007/users/{USER_ID}/tours/?page={page + 1}"}
+        return body
+
+    def tour(self, tour_id):
+        index = tour_id - FIRST_TOUR_ID
+        tour = self.tour_summary(index)
+        recorded = tour["type"] == "tour_recorded"
+        items = []
+        for k in range(self.config.coordinates):
+            coord = {"lat": 47.0 + k * 1e-5, "lng": 11.0 + k * 1.3e-5, "alt": 500.0 + (k % 100) * 0.5}
+            coord["t"] = 1600000000000 + k * 1000 if recorded else k * 1000
+            items.append(coord)
+
+        timeline = []
+        for k in range(self.config.highlights):
+            timeline.append({"type": "highlight", "_embedded": {"reference": {
+                "id": 5000 + (index + k) % 1000,
+                "name": f"Highlight {k}",
+                "mid_point": {"lat": 47.0 + k * 1e-3, "lng": 11.0, "alt": 600.0},
+                "_embedded": {"front_image": {"src": f"{self.base_url}/images/hl/{k}.jpg?width=200"}},
+            }}})
+
+        tour["_embedded"] = {
+            "coordinates": {"items": items},
+            "creator": {"display_name": DISPLAY_NAME, "username": USER_ID},
+            "timeline": {"_embedded": {"items": timeline}},
+        }
+        return tour
+
+    def highlight_tips(self, highlight_id):
+        return {"_embedded": {"items": [
+            {"text": f"Tip {k} for highlight {highlight_id}", "_embedded": {"creator": {"display_name": "Tipper"}}}
+            for k in range(2)
+        ]}}
+
+    def highlight(self, highlight_id):
+        return {"id": highlight_id, "base_name": f"Highlight {highlight_id}",
+                "_embedded": {"creator": {"display_name": DISPLAY_NAME}}}
+
+    def tour_images(self, tour_id):
+        items = []
+        for k in range(self.config.images):
+            items.append({
+                "id": tour_id * 100 + k,
+                "src": f"{self.base_url}/images/{tour_id}/{k}.jpg?width=1000",
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(1600000000 + k)),
+                "location": {"lat": 47.0, "lng": 11.0, "alt": 500},
+                "_embedded": {"creator": {"display_name": DISPLAY_NAME}},
+            })
+        return {"_links": {}, "_embedded": {"items": items}}
+
+    def image(self):
+        if self._jpeg is None:
+            from PIL import Image
+
+            out = io.BytesIO()
+            Image.new("RGB", (64, 48), (40, 120, 200)).save(out, format="JPEG")
+            jpeg = out.getvalue()
+            # pad to the configured size with comment segments, the image stays valid
+            padding = bytearray()
+            missing = self.config.image_size - len(jpeg)
+            while missing > 4:
+                chunk = min(missing - 4, 65533)
+                padding += b"\xff\xfe" + (chunk + 2).to_bytes(2, "big") + b"\0" * chunk
+                missing -= chunk + 4
+            self._jpeg = jpeg[:2] + bytes(padding) + jpeg[2:]
+        return self._jpeg
+
+    def route(self, path):
+        # returns (status, content type, body bytes)
+        path, _, query = path.partition("?")
+        if re.fullmatch(r"/v006/account/email/[^/]+/", path):
+            return 200, "application/json", {"username": USER_ID, "password": TOKEN,
+                                              "user": {"displayname": DISPLAY_NAME}}
+        if path == f"/v007/users/{USER_ID}/tours/":
+            page = re.search(r"(?:^|&)page=(\d+)", query)
+            return 200, "application/json", self.tours_page(int(page.group(1)) if page else 0)
+
+        m = re.fullmatch(r"/v007/tours/(\d+)", path)
+        if m and FIRST_TOUR_ID <= int(m.group(1)) < FIRST_TOUR_ID + self.config.tours:
+            return 200, "application/json", self.tour(int(m.group(1)))
+        m = re.fullmatch(r"/v007/tours/(\d+)/cover_images/", path)
+        if m:
+            return 200, "application/json", self.tour_images(int(m.group(1)))
+        m = re.fullmatch(r"/v007/highlights/(\d+)/tips/", path)
+        if m:
+            return 200, "application/json", self.highlight_tips(m.group(1))
+        m = re.fullmatch(r"/v007/highlights/(\d+)", path)
+        if m:
+            return 200, "application/json", self.highlight(int(m.group(1)))
+        if path.startswith("/images/"):
+            return 200, "image/jpeg", self.image()
+
+        return 404, "application/json", {"status": 404, "error": "NotFound", "message": path}
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections when many clients connect at once
+    request_queue_size = 1024
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, Nagle would delay every keep-alive response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        mock = self.server.mock
+        fail = mock.count_request()
+        if mock.config.latency > 0:
+            time.sleep(mock.config.latency)
+
+        headers = {}
+        if fail == "error":
+            status, content_type, body = 500, "application/json", {"status": 500, "error": "InternalServerError"}
+        elif fail == "throttle":
+            status, content_type, body = 429, "application/json", {"status": 429, "error": "TooManyRequests"}
+            headers["Retry-After"] = str(mock.config.retry_after)
+        else:
+            status, content_type, body = mock.route(self.path)
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(config, host="127.0.0.1", port=0):
+    # Start the mock server on a background thread; call shutdown() on the result to stop it.
+    server = MockServer((host, port), MockHandler)
+    server.mock = MockKomoot(config)
+    server.mock.base_url = f"http://{host}:{server.server_address[1]}"
+    server.url = server.mock.base_url
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    defaults = MockConfig()
+    parser.add_argument("--tours", type=int, default=defaults.tours, help="Number of tours on the account")
+    parser.add_argument("--page-size", type=int, default=defaults.page_size, help="Tours per list page")
+    parser.add_argument("--coordinates", type=int, default=defaults.coordinates, help="Coordinates per tour")
+    parser.add_argument("--highlights", type=int, default=defaults.highlights, help="Highlights per tour")
+    parser.add_argument("--images", type=int, default=defaults.images, help="Images per tour")
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="Added latency per request in seconds")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="Fraction of requests failing with 500")
+    parser.add_argument("--throttle-rate", type=float, default=defaults.throttle_rate, help="Fraction of requests rejected with 429")
+    parser.add_argument("--retry-after", type=int, default=defaults.retry_after, help="Retry-After seconds of 429 responses")
+    parser.add_argument("--image-size", type=int, default=defaults.image_size, help="Size of served images in bytes")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="Seed of the random errors")
+
+
+def config_from_args(args):
+    return MockConfig(tours=args.tours, page_size=args.page_size, coordinates=args.coordinates,
+                      highlights=args.highlights, images=args.images, latency=args.latency,
+                      error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                      image_size=args.image_size, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(config_from_args(args), port=args.port)
+    print(f"Mock Komoot API listening on {server.url} (user id {USER_ID}), Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
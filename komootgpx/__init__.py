@@ -1 +1,8 @@
-from .komootgpx import *
\ No newline at end of file
+from .komootgpx import *
+
+
+def __getattr__(name):
+    # KomootApi, GpxCompiler, ImageDownloaderWithExif, CREDFILE and HASHFILE are resolved lazily,
+    # see komootgpx.komootgpx.__getattr__
+    from . import komootgpx
+    return getattr(komootgpx, name)
@@ -0,0 +1,259 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError as e:
+    raise ImportError("The analytics export requires pyarrow, install it with: pip install 'komootgpx[analytics]'") from e
+
+from .gpxcompiler import Point, Route
+from .utils import parse_date_str
+
+# Layout of an analytics directory, partitioned by the year of the tour date (hive style):
+#   tours/year=2024/part-<id>.parquet   one row per tour
+#   points/year=2024/part-<id>.parquet  one row per route point, the same tours as the tours part
+#   _komootgpx.json                     the live parts and the changed_at of every tour in them
+# Parquet files not listed in the manifest are leftovers of an aborted run and are removed.
+MANIFEST = "_komootgpx.json"
+
+TOURS_SCHEMA = pa.schema([
+    ("tour_id", pa.int64()),
+    ("name", pa.string()),
+    ("type", pa.string()),
+    ("sport", pa.string()),
+    ("status", pa.string()),
+    ("date", pa.timestamp("ms", tz="UTC")),
+    ("changed_at", pa.timestamp("ms", tz="UTC")),
+    ("distance", pa.float64()),
+    ("duration", pa.float64()),
+    ("elevation_up", pa.float64()),
+    ("elevation_down", pa.float64()),
+    ("points", pa.int64()),
+])
+
+POINTS_SCHEMA = pa.schema([
+    ("tour_id", pa.int64()),
+    ("index", pa.int32()),
+    ("lat", pa.float64()),
+    ("lng", pa.float64()),
+    ("alt", pa.float64()),
+    ("time", pa.timestamp("ms", tz="UTC")),
+])
+
+
+def _doubles(column, valid=None):
+    # array('d') column of a Route as a float64 array without copying, null where valid is 0
+    values = pa.Array.from_buffers(pa.float64(), len(column), [None, pa.py_buffer(column)])
+    if valid is None:
+        return values
+    mask = pa.Array.from_buffers(pa.uint8(), len(valid), [None, pa.py_buffer(bytes(valid))]).cast(pa.bool_())
+    return pc.if_else(mask, values, pa.scalar(None, pa.float64()))
+
+
+def tour_partition(tour):
+    return "year=" + tour["date"][:4]
+
+
+def tour_tables(tour):
+    # (tours, points) tables with the single row of a tour and the rows of its route points
+    tour_id = int(tour["id"])
+    route = Route.from_items(tour["_embedded"]["coordinates"]["items"])
+    count = len(route)
+    date = datetime.strptime(tour["date"], "%Y-%m-%dT%H:%M:%S.%f%z")
+
+    # coordinates without a location ({} items) are kept as nulls, so indices match the route
+    lat = _doubles(route.lat)
+    lng = _doubles(route.lng)
+    undefined = pc.and_(pc.equal(lat, Point.CONST_UNDEFINED), pc.equal(lng, Point.CONST_UNDEFINED))
+    null = pa.scalar(None, pa.float64())
+    lat = pc.if_else(undefined, null, lat)
+    lng = pc.if_else(undefined, null, lng)
+
+    # like in the GPX, times are offsets from the tour date when the first one is 0, otherwise epoch milliseconds
+    times = pc.cast(pc.round(_doubles(route.time, route.time_valid)), pa.int64())
+    if count and route.time_valid[0] and route.time[0] == 0:
+        times = pc.add(times, int(date.timestamp() * 1000))
+
+    points = pa.table([
+        pa.repeat(pa.scalar(tour_id, pa.int64()), count),
+        pa.array(range(count), pa.int32()),
+        lat,
+        lng,
+        _doubles(route.alt, route.alt_valid),
+        times.cast(pa.timestamp("ms", tz="UTC")),
+    ], schema=POINTS_SCHEMA)
+
+    tours = pa.Table.from_pylist([{
+        "tour_id": tour_id,
+        "name": tour.get("name"),
+        "type": tour.get("type"),
+        "sport": tour.get("sport"),
+        "status": tour.get("status"),
+        "date": date,
+        "changed_at": parse_date_str(tour["changed_at"]),
+        "distance": tour.get("distance"),
+        "duration": tour.get("duration"),
+        "elevation_up": tour.get("elevation_up"),
+        "elevation_down": tour.get("elevation_down"),
+        "points": count,
+    }], schema=TOURS_SCHEMA)
+    return tours, points
+
+
+class AnalyticsDataset:
+    # Route points and metadata of all exported tours as partitioned Parquet files, for scans over
+    # a whole account without parsing GPX. Tours are buffered and written on flush: each year
+    # partition touched gets one new part with the added tours and the remaining rows of the parts
+    # holding replaced or removed tours, all other parts are kept as they are.
+    # Safe to share between threads.
+
+    # buffered route points before the largest partition is written out early
+    FLUSH_POINTS = 2_000_000
+    # parts of a partition before they are merged into one
+    MAX_PARTS = 16
+
+    def __init__(self, root):
+        self.root = root
+        self.written = 0
+        self.removed = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_points = 0
+        self._removals = set()
+        self._closed = False
+
+        os.makedirs(root, exist_ok=True)
+        # part ("year=2024/part-<id>.parquet") -> {tour id: changed_at}
+        self._parts = {}
+        manifest = os.path.join(root, MANIFEST)
+        if os.path.isfile(manifest):
+            with open(manifest, "r", encoding="utf-8") as f:
+                self._parts = json.load(f)["parts"]
+        # tour id -> (part, changed_at)
+        self._index = {int(tour_id): (part, changed_at)
+                       for part, tours in self._parts.items() for tour_id, changed_at in tours.items()}
+        self._remove_orphans()
+
+    def __str__(self):
+        return self.root
+
+    def _remove_orphans(self):
+        for table in ("tours", "points"):
+            for directory, _, files in os.walk(os.path.join(self.root, table)):
+                for name in files:
+                    part = os.path.relpath(os.path.join(directory, name), os.path.join(self.root, table))
+                    if part.replace(os.sep, "/") not in self._parts:
+                        os.unlink(os.path.join(directory, name))
+
+    def is_current(self, tour_id, changed_at):
+        # True if the dataset holds the tour as of changed_at
+        with self._lock:
+            entry = self._index.get(int(tour_id))
+            return entry is not None and entry[1] == changed_at
+
+    def add(self, tour):
+        tables = tour_tables(tour)
+        partition = tour_partition(tour)
+        with self._lock:
+            previous = self._pending.setdefault(partition, {}).pop(int(tour["id"]), None)
+            if previous is not None:
+                self._pending_points -= previous[2]
+            self._pending[partition][int(tour["id"])] = (*tables, len(tables[1]), tour["changed_at"])
+            self._pending_points += len(tables[1])
+            if self._pending_points > self.FLUSH_POINTS:
+                largest = max(self._pending, key=lambda p: sum(entry[2] for entry in self._pending[p].values()))
+                self._flush([largest])
+
+    def retain(self, tour_ids):
+        # removes every tour not in tour_ids on the next flush
+        keep = {int(tour_id) for tour_id in tour_ids}
+        with self._lock:
+            self._removals.update(tour_id for tour_id in self._index if tour_id not in keep)
+
+    def close(self):
+        # writes all buffered tours and removals, the dataset is unchanged if there are none
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._pending or self._removals:
+                self._flush(list(self._pending))
+
+    def _flush(self, partitions):
+        # called with the lock held
+        added = {partition: self._pending.pop(partition) for partition in partitions}
+        self._pending_points -= sum(entry[2] for tours in added.values() for entry in tours.values())
+        dropped = {tour_id for tours in added.values() for tour_id in tours} | self._removals
+        self._removals = set()
+
+        # parts holding a dropped tour are rewritten, together with the new tours of their partition
+        rewrite = {}
+        for tour_id in dropped:
+            if tour_id in self._index:
+                part = self._index[tour_id][0]
+                rewrite.setdefault(part.split("/")[0], set()).add(part)
+        for partition in added:
+            rewrite.setdefault(partition, set())
+        for partition, parts in rewrite.items():
+            others = [part for part in self._parts if part.startswith(partition + "/") and part not in parts]
+            if len(others) + 1 > self.MAX_PARTS:
+                parts.update(others)
+
+        parts = dict(self._parts)
+        for partition, old_parts in rewrite.items():
+            tours = []
+            points = []
+            changed_at = {}
+            for part in old_parts:
+                kept = {tour_id: stamp for tour_id, stamp in self._parts[part].items() if int(tour_id) not in dropped}
+                if kept:
+                    ids = pa.array([int(tour_id) for tour_id in kept], pa.int64())
+                    for table, rows in (("tours", tours), ("points", points)):
+                        data = pq.read_table(os.path.join(self.root, table, part))
+                        rows.append(data.filter(pc.is_in(data["tour_id"], value_set=ids)))
+                    changed_at.update(kept)
+                del parts[part]
+            for tour_id, (tour_row, point_rows, _, stamp) in added.get(partition, {}).items():
+                tours.append(tour_row)
+                points.append(point_rows)
+                changed_at[str(tour_id)] = stamp
+            if not changed_at:
+                continue
+
+            part = f"{partition}/part-{uuid.uuid4().hex}.parquet"
+            # sorted by tour, so row group statistics narrow down scans of single tours
+            self._write(pa.concat_tables(points).sort_by([("tour_id", "ascending"), ("index", "ascending")]),
+                        "points", part)
+            self._write(pa.concat_tables(tours).sort_by("date"), "tours", part)
+            parts[part] = changed_at
+
+        # the manifest switches to the new parts at once, then the replaced ones are deleted
+        self._write_manifest(parts)
+        obsolete = set(self._parts) - set(parts)
+        self.removed += len({tour_id for tour_id in dropped if tour_id in self._index} -
+                            {tour_id for tours in added.values() for tour_id in tours})
+        self.written += sum(len(tours) for tours in added.values())
+        self._parts = parts
+        self._index = {int(tour_id): (part, stamp) for part, tours in parts.items() for tour_id, stamp in tours.items()}
+        for part in obsolete:
+            for table in ("tours", "points"):
+                os.unlink(os.path.join(self.root, table, part))
+
+    def _write(self, table, name, part):
+        path = os.path.join(self.root, name, part)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # hidden while it's written, query engines skip files starting with "."
+        tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(path))
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, path)
+
+    def _write_manifest(self, parts):
+        path = os.path.join(self.root, MANIFEST)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "parts": parts}, f)
+        os.replace(path + ".tmp", path)
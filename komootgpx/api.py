@@ -1,9 +1,59 @@
 import sys
 import base64
-import json
+import threading
+import time
+from concurrent.futures import Future
 import requests
-
-from .utils import print_error, bcolor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .fastjson import decode_tour, loads
+from .metrics import Metrics, endpoint_of
+from .ratelimit import RateLimitedAdapter
+from .utils import print_error, print_info, print_line, print_warning, parse_date_str, bcolor
+
+API_URL = "https://api.komoot.de"
+
+TOUR_QUERY = "?_embedded=coordinates,way_types,surfaces,directions,participants,timeline" \
+             "&directions=v2&fields=timeline&format=coordinate_array" \
+             "&timeline_highlights_fields=tips,recommenders"
+
+def create_session(pool_size=10, retries=3, backoff=0.5, limiter=None):
+    # One keep-alive session per run, shared by the API client and the image downloader.
+    # Connection errors and 5xx responses are retried with exponential backoff. Throttling
+    # responses (429/503) are left to the rate limiter, which slows down all requests at once.
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(500, 502, 504) if limiter is not None else (500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+        # urllib3 would otherwise sleep through a Retry-After on its own, unnoticed by the limiter
+        respect_retry_after_header=limiter is None,
+    )
+    if limiter is not None:
+        adapter = RateLimitedAdapter(limiter, throttle_retries=retries, pool_connections=pool_size,
+                                     pool_maxsize=pool_size, max_retries=retry)
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def conditional_headers(validators):
+    # request headers revalidating a response stored with store_validators()
+    headers = {}
+    if validators is not None:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    return headers or None
 
 class BasicAuthToken(requests.auth.AuthBase):
     def __init__(self, key, value):
@@ -17,27 +67,40 @@ class BasicAuthToken(requests.auth.AuthBase):
 
 
 class KomootApi:
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, session=None, base_url=API_URL, cache=None, http_cache=None, metrics=None):
+        self.base_url = base_url.rstrip("/")
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.cache = cache
+        self.http_cache = http_cache
         self.user_id = ''
         self.token = ''
         self.request_count = 0
         self.debug = debug
+        self.session = session if session is not None else create_session()
+        self._lock = threading.Lock()
+        # run-scoped memo of highlight lookups, shared by every tour and image of this run
+        self._memo = {}
+        self.memo_hits = 0
+        self.memo_misses = 0
 
     def __build_header(self):
         if self.user_id and self.token:
             return BasicAuthToken(self.user_id, self.token)
         return None
 
-    def __send_request(self, url, auth, critical=True):
-        self.request_count += 1
-        r = requests.get(url, auth=auth)
+    def __send_request(self, url, auth, critical=True, headers=None):
+        with self._lock:
+            self.request_count += 1
+            request_no = self.request_count
+        start = time.perf_counter()
+        r = self.session.get(url, auth=auth, headers=headers)
+        self.metrics.record_request(endpoint_of(url), r.status_code, time.perf_counter() - start, len(r.content))
 
         if self.debug:
-            with open(f"komootgpx-debug-{self.request_count}.txt", "w", encoding="utf-8") as dbgf:
-                dbgf.write(r.text)
+            print_info(f"Request {request_no}: {r.status_code} {url} ({len(r.content)} bytes)")
 
-        if r.status_code != 200:
-            print_error("Error " + str(r.status_code) + ": " + str(r.json()))
+        if r.status_code != 200 and not (headers and r.status_code == 304):
+            print_error("Error " + str(r.status_code) + ": " + str(loads(r.content)))
             if critical:
                 sys.exit(1)
         return r
@@ -45,10 +108,10 @@ class KomootApi:
     def login(self, email, password):
         print("Logging in...")
 
-        r = self.__send_request("https://api.komoot.de/v006/account/email/" + email + "/",
+        r = self.__send_request(self.base_url + "/v006/account/email/" + email + "/",
                                     BasicAuthToken(email, password))
 
-        rj = r.json()
+        rj = loads(r.content)
         self.user_id = rj['username']
         self.token = rj['password']
         self.display_name = rj["user"]["displayname"]
@@ -64,21 +127,41 @@ class KomootApi:
 
         print("Logged in as '" + self.display_name + "'")
 
-    def fetch_tours(self, tour_type="tour_all", silent=False):
+    def fetch_tours(self, tour_type="tour_all", silent=False, changed_since=None):
+        # With changed_since (a datetime), only tours changed after it are returned. They are
+        # requested newest change first, so paging stops at the first page reaching an older tour.
         if not silent:
             print("Fetching tours of user '" + self.user_id + "'...")
 
         results = {}
         has_next_page = True
-        current_uri = "https://api.komoot.de/v007/users/" + self.user_id + "/tours/"
+        current_uri = self.base_url + "/v007/users/" + self.user_id + "/tours/"
+        if changed_since is not None:
+            current_uri += "?sort_field=changed_at&sort_direction=desc"
+        last_changed_at = None
+        sorted_listing = True
         while has_next_page:
             r = self.__send_request(current_uri, self.__build_header())
 
-            has_next_page = 'next' in r.json()['_links'] and 'href' in r.json()['_links']['next']
+            rj = loads(r.content)
+            has_next_page = 'next' in rj['_links'] and 'href' in rj['_links']['next']
             if has_next_page:
-                current_uri = r.json()['_links']['next']['href']
+                current_uri = rj['_links']['next']['href']
+
+            tours = rj['_embedded']['tours']
+            if changed_since is not None and tours:
+                stamps = [parse_date_str(tour['changed_at']) for tour in tours]
+                if sorted_listing and (stamps != sorted(stamps, reverse=True) or
+                                       (last_changed_at is not None and stamps[0] > last_changed_at)):
+                    # never stop early on a listing we can't prove to be sorted
+                    print_warning("Tours are not sorted by change date, listing all pages")
+                    sorted_listing = False
+                last_changed_at = stamps[-1]
+
+                if sorted_listing and stamps[-1] <= changed_since:
+                    has_next_page = False
+                tours = [tour for tour, stamp in zip(tours, stamps) if stamp > changed_since]
 
-            tours = r.json()['_embedded']['tours']
             for tour in tours:
                 if tour_type != "tour_all" and tour_type != tour['type']:
                     continue
@@ -88,52 +171,121 @@ class KomootApi:
         return results
 
     def fetch_tour(self, tour_id, language="en"):
-        print("Fetching tour '" + tour_id + "'...")
-
-        r = self.__send_request("https://api.komoot.de/v007/tours/" + tour_id + "?_embedded=coordinates,way_types,"
-                                                                                "surfaces,directions,participants,"
-                                                                                "timeline&hl=" + language + "&directions=v2&fields"
-                                                                                "=timeline&format=coordinate_array"
-                                                                                "&timeline_highlights_fields=tips,"
-                                                                                "recommenders",
-                                self.__build_header())
-        return r.json()
+        print_line("Fetching tour '" + tour_id + "'...")
+
+        key = tour_id + ":" + language
+        validators = self.cached_validators("tour", key)
+        r = self.__send_request(self.base_url + "/v007/tours/" + tour_id + TOUR_QUERY + "&hl=" + language,
+                                self.__build_header(), headers=conditional_headers(validators))
+        if r.status_code == 304:
+            body = validators["body"]
+            # entries of older versions hold the decoded tour
+            return decode_tour(body) if isinstance(body, str) else body
+
+        # the raw body is stored, it's decoded again on every use
+        self.store_validators("tour", key, r, body=r.text)
+        return decode_tour(r.content)
+
+    def cached_validators(self, kind, key):
+        # ETag/Last-Modified (plus any extra values) stored with a previous response, or None
+        if self.http_cache is None:
+            return None
+        return self.http_cache.get(kind, key)
+
+    def store_validators(self, kind, key, r, **extra):
+        # remember the validators of a successful response, so the next run can send a conditional request
+        if self.http_cache is None or r.status_code != 200:
+            return
+        etag = r.headers.get("ETag")
+        last_modified = r.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.http_cache.put(kind, key, {"etag": etag, "last_modified": last_modified, **extra})
+
+    def __cached(self, kind, key):
+        if self.cache is None:
+            return None
+        return self.cache.get(kind, key)
+
+    def __store(self, kind, key, r):
+        # only successful responses are cached, errors are retried on the next run
+        rj = loads(r.content)
+        if self.cache is not None and r.status_code == 200:
+            self.cache.put(kind, key, rj)
+        return rj
+
+    def __memoized(self, kind, key, fetch):
+        # Every highlight is looked up at most once per run. Concurrent lookups of the
+        # same highlight wait for the first one instead of sending their own request.
+        memo_key = (kind, str(key))
+        with self._lock:
+            future = self._memo.get(memo_key)
+            owner = future is None
+            if owner:
+                future = self._memo[memo_key] = Future()
+                self.memo_misses += 1
+            else:
+                self.memo_hits += 1
+        if not owner:
+            return future.result()
+
+        try:
+            value = self.__cached(kind, key)
+            if value is None:
+                value = fetch()
+        except BaseException as e:
+            with self._lock:
+                del self._memo[memo_key]
+            future.set_exception(e)
+            raise
+        future.set_result(value)
+        return value
+
+    def memo_stats_str(self):
+        total = self.memo_hits + self.memo_misses
+        ratio = f"{100.0 * self.memo_hits / total:.1f}%" if total else "n/a"
+        return f"{self.memo_hits} hits, {self.memo_misses} misses ({ratio} hit ratio)"
 
     def fetch_highlight_tips(self, highlight_id):
-        print("Fetching highlight '" + highlight_id + "'...")
+        return self.__memoized("highlight_tips", highlight_id, lambda: self.__fetch_highlight_tips(highlight_id))
+
+    def __fetch_highlight_tips(self, highlight_id):
+        print_line("Fetching highlight '" + highlight_id + "'...")
 
-        r = self.__send_request("https://api.komoot.de/v007/highlights/" + highlight_id + "/tips/",
+        r = self.__send_request(self.base_url + "/v007/highlights/" + highlight_id + "/tips/",
                                 self.__build_header(), critical=False)
 
-        return r.json()
+        return self.__store("highlight_tips", highlight_id, r)
 
     def fetch_tour_images(self, tour_id, silent=False):
         if not silent:
-            print("Fetching images of tour '" + str(tour_id) + "'...")
+            print_line("Fetching images of tour '" + str(tour_id) + "'...")
 
         results = {}
         has_next_page = True
-        current_uri = "https://api.komoot.de/v007/tours/" + tour_id + "/cover_images/"
+        current_uri = self.base_url + "/v007/tours/" + tour_id + "/cover_images/"
         while has_next_page:
             r = self.__send_request(current_uri, self.__build_header())
 
-            has_next_page = 'next' in r.json()['_links'] and 'href' in r.json()['_links']['next']
+            rj = loads(r.content)
+            has_next_page = 'next' in rj['_links'] and 'href' in rj['_links']['next']
             if has_next_page:
-                current_uri = r.json()['_links']['next']['href']
+                current_uri = rj['_links']['next']['href']
 
-            images = r.json().get('_embedded', {}).get('items', [])
+            images = rj.get('_embedded', {}).get('items', [])
             for image in images:
                 results[image['id']] = image
 
-        print("Found " + str(len(results)) + " images")
+        print_line("Found " + str(len(results)) + " images")
         return results
 
     def fetch_highlight(self, highlight_id, silent=False):
+        return self.__memoized("highlight", highlight_id, lambda: self.__fetch_highlight(highlight_id, silent))
+
+    def __fetch_highlight(self, highlight_id, silent):
         if not silent:
-            print("Fetching highlight '" + str(highlight_id) + "'...")
+            print_line("Fetching highlight '" + str(highlight_id) + "'...")
 
-        results = {}
-        current_uri = "https://api.komoot.de/v007/highlights/" + str(highlight_id)
+        current_uri = self.base_url + "/v007/highlights/" + str(highlight_id)
         r = self.__send_request(current_uri, self.__build_header())
 
-        return r.json()
+        return self.__store("highlight", highlight_id, r)
@@ -0,0 +1,140 @@
+try:
+    import httpx
+except ImportError as e:
+    raise ImportError("AsyncKomootApi requires httpx, install it with: pip install 'komootgpx[async]'") from e
+
+from .api import API_URL, TOUR_QUERY
+from .fastjson import decode_tour, loads
+from .utils import print_error, print_info
+
+
+class KomootApiError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f"Error {status_code}: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class AsyncKomootApi:
+    # asyncio counterpart of KomootApi with the same methods and return shapes.
+    # All requests share one HTTP/2 capable client, so thousands of calls can be
+    # multiplexed over a handful of connections from a single event loop.
+    # Unlike KomootApi, a failing critical request raises KomootApiError instead of exiting.
+
+    def __init__(self, debug=False, client=None, base_url=API_URL, max_connections=100, http2=True):
+        self.base_url = base_url.rstrip("/")
+        self.user_id = ''
+        self.token = ''
+        self.display_name = ''
+        self.request_count = 0
+        self.debug = debug
+        self._owns_client = client is None
+        self.client = client if client is not None else httpx.AsyncClient(
+            http2=http2,
+            timeout=30,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_client:
+            await self.client.aclose()
+
+    def __build_auth(self):
+        if self.user_id and self.token:
+            return httpx.BasicAuth(self.user_id, self.token)
+        return None
+
+    async def __send_request(self, url, auth, critical=True):
+        self.request_count += 1
+        request_no = self.request_count
+        r = await self.client.get(url, auth=auth)
+
+        if self.debug:
+            print_info(f"Request {request_no}: {r.status_code} {url} ({len(r.content)} bytes)")
+
+        if r.status_code != 200:
+            if critical:
+                raise KomootApiError(r.status_code, r.text)
+            print_error("Error " + str(r.status_code) + ": " + r.text)
+        return r
+
+    async def __fetch_pages(self, uri, embedded_key):
+        results = []
+        while uri:
+            rj = loads((await self.__send_request(uri, self.__build_auth())).content)
+            results.extend(rj.get('_embedded', {}).get(embedded_key, []))
+            uri = rj['_links'].get('next', {}).get('href')
+        return results
+
+    async def login(self, email, password):
+        print("Logging in...")
+
+        r = await self.__send_request(self.base_url + "/v006/account/email/" + email + "/",
+                                      httpx.BasicAuth(email, password))
+
+        rj = loads(r.content)
+        self.user_id = rj['username']
+        self.token = rj['password']
+        self.display_name = rj["user"]["displayname"]
+
+        print("Logged in as '" + self.display_name + "'")
+
+    def login_with_token(self, user_id, token, display_name):
+        print("Logging in with token...")
+
+        self.user_id = user_id
+        self.token = token
+        self.display_name = display_name
+
+        print("Logged in as '" + self.display_name + "'")
+
+    async def fetch_tours(self, tour_type="tour_all", silent=False):
+        if not silent:
+            print("Fetching tours of user '" + self.user_id + "'...")
+
+        results = {}
+        for tour in await self.__fetch_pages(self.base_url + "/v007/users/" + self.user_id + "/tours/", 'tours'):
+            if tour_type != "tour_all" and tour_type != tour['type']:
+                continue
+            results[tour['id']] = tour
+
+        print("Found " + str(len(results)) + " tours")
+        return results
+
+    async def fetch_tour(self, tour_id, language="en"):
+        print("Fetching tour '" + tour_id + "'...")
+
+        r = await self.__send_request(self.base_url + "/v007/tours/" + tour_id + TOUR_QUERY + "&hl=" + language,
+                                      self.__build_auth())
+        return decode_tour(r.content)
+
+    async def fetch_highlight_tips(self, highlight_id):
+        print("Fetching highlight '" + highlight_id + "'...")
+
+        r = await self.__send_request(self.base_url + "/v007/highlights/" + highlight_id + "/tips/",
+                                      self.__build_auth(), critical=False)
+        return loads(r.content)
+
+    async def fetch_tour_images(self, tour_id, silent=False):
+        if not silent:
+            print("Fetching images of tour '" + str(tour_id) + "'...")
+
+        results = {}
+        for image in await self.__fetch_pages(self.base_url + "/v007/tours/" + tour_id + "/cover_images/", 'items'):
+            results[image['id']] = image
+
+        print("Found " + str(len(results)) + " images")
+        return results
+
+    async def fetch_highlight(self, highlight_id, silent=False):
+        if not silent:
+            print("Fetching highlight '" + str(highlight_id) + "'...")
+
+        r = await self.__send_request(self.base_url + "/v007/highlights/" + str(highlight_id), self.__build_auth())
+        return loads(r.content)
@@ -0,0 +1,124 @@
+import os
+import sqlite3
+import threading
+import time
+
+from .fastjson import dumps, loads
+from .utils import print_warning
+
+
+class PersistentCache:
+    # Small SQLite-backed JSON cache with per-entry TTL and LRU eviction.
+    # Entries are namespaced by kind (e.g. "highlight", "highlight_tips") and keyed by id.
+    # The cache is bounded by max_entries and/or max_bytes of stored values (None: unbounded).
+    # Safe to share between threads.
+
+    # access times of hits are written back in batches instead of once per hit
+    TOUCH_BATCH = 100
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=10000, max_bytes=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._touched = {}
+        self._lock = threading.Lock()
+
+        try:
+            self._db = self._open(path)
+        except sqlite3.DatabaseError:
+            print_warning(f"Cache '{path}' is corrupt, starting with an empty cache")
+            os.unlink(path)
+            self._db = self._open(path)
+
+        with self._db:
+            self._db.execute("DELETE FROM entries WHERE stored_at < ?", (time.time() - self.ttl,))
+        self._count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self._bytes = 0
+        if max_bytes is not None:
+            self._bytes = self._db.execute("SELECT COALESCE(SUM(length(CAST(value AS BLOB))), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def _open(path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                   "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                   "stored_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+                   "PRIMARY KEY (kind, key))")
+        db.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+        return db
+
+    def get(self, kind, key):
+        key = str(key)
+        with self._lock:
+            row = self._db.execute("SELECT value, stored_at FROM entries WHERE kind = ? AND key = ?",
+                                   (kind, key)).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._touched[(kind, key)] = now
+            if len(self._touched) >= self.TOUCH_BATCH:
+                with self._db:
+                    self._flush_touched()
+            return loads(row[0])
+
+    def put(self, kind, key, value):
+        key = str(key)
+        value = dumps(value)
+        now = time.time()
+        with self._lock, self._db:
+            self._flush_touched()
+            if self.max_bytes is not None:
+                row = self._db.execute("SELECT length(CAST(value AS BLOB)) FROM entries WHERE kind = ? AND key = ?",
+                                       (kind, key)).fetchone()
+                self._bytes += len(value.encode("utf-8")) - (row[0] if row is not None else 0)
+            self._db.execute("INSERT OR REPLACE INTO entries (kind, key, value, stored_at, accessed_at) "
+                             "VALUES (?, ?, ?, ?, ?)", (kind, key, value, now, now))
+            self._count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            if self.max_entries is not None and self._count > self.max_entries:
+                self._db.execute("DELETE FROM entries WHERE rowid IN "
+                                 "(SELECT rowid FROM entries ORDER BY accessed_at LIMIT ?)",
+                                 (self._count - self.max_entries,))
+                self._count = self.max_entries
+                if self.max_bytes is not None:
+                    self._bytes = self._db.execute("SELECT COALESCE(SUM(length(CAST(value AS BLOB))), 0) "
+                                                   "FROM entries").fetchone()[0]
+            if self.max_bytes is not None and self._bytes > self.max_bytes:
+                self._evict_bytes()
+
+    def close(self):
+        with self._lock:
+            with self._db:
+                self._flush_touched()
+            self._db.close()
+
+    def stats_str(self):
+        total = self.hits + self.misses
+        ratio = f"{100.0 * self.hits / total:.1f}%" if total else "n/a"
+        size = f", {self._bytes / (1024 * 1024):.1f} MB" if self.max_bytes is not None else ""
+        return f"{self.hits} hits, {self.misses} misses ({ratio} hit ratio), {self._count} entries{size}"
+
+    def _evict_bytes(self):
+        # least recently used entries until the stored values fit into max_bytes again
+        excess = self._bytes - self.max_bytes
+        rowids = []
+        for rowid, size in self._db.execute("SELECT rowid, length(CAST(value AS BLOB)) FROM entries "
+                                            "ORDER BY accessed_at"):
+            rowids.append((rowid,))
+            excess -= size
+            self._bytes -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM entries WHERE rowid = ?", rowids)
+        self._count -= len(rowids)
+
+    def _flush_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE entries SET accessed_at = ? WHERE kind = ? AND key = ?",
+                                 [(t, kind, key) for (kind, key), t in self._touched.items()])
+            self._touched.clear()
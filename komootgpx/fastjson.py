@@ -0,0 +1,132 @@
+import json
+import re
+
+# orjson is optional (pip install 'komootgpx[fast]'), the standard library json is the fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def set_backend(name):
+    # switch between "orjson" and "json", e.g. to compare them
+    global BACKEND
+    if name == "orjson" and orjson is None:
+        raise ImportError("orjson is not installed, install it with: pip install 'komootgpx[fast]'")
+    if name not in ("orjson", "json"):
+        raise ValueError(f"Unknown JSON backend '{name}'")
+    BACKEND = name
+
+
+def loads(data):
+    # data may be bytes (a response body) or str
+    if BACKEND == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value):
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(value).decode("utf-8")
+        except TypeError:
+            # e.g. integers beyond 64 bit, which only the standard library handles
+            pass
+    return json.dumps(value)
+
+
+# Decoder of the `_embedded.coordinates.items` array of a tour straight into the columns of a
+# Route, without building a dict per coordinate. When every item has the same keys in the same
+# order, deleting the keys and braces leaves a flat array of numbers, which the JSON backend
+# decodes in one call and which is split into columns by slicing. Any other shape of items falls
+# back to decoding the whole tour with loads() and Route.from_items().
+_COORDINATES = re.compile(rb'("coordinates"\s*:\s*\{\s*"items"\s*:\s*)\[')
+_PLACEHOLDER = b'["komootgpx:route"]'
+_NUMBER_CHARS = b"0123456789.-+eE"
+_KEY_CHARS = b'{}":latng'
+# skeletons of an item without its numbers, compact or with the separators of Python's json.dumps()
+_ITEM_KEYS = {}
+for _colon, _comma in ((b":", b","), (b": ", b", ")):
+    for _keys in (("lat", "lng"), ("lat", "lng", "alt"), ("lat", "lng", "t"), ("lat", "lng", "alt", "t")):
+        _ITEM_KEYS[b"{" + _comma.join(b'"' + key.encode() + b'"' + _colon for key in _keys) + b"}"] = _keys
+
+
+def decode_tour(content):
+    # Decodes a tour response (bytes or str). `_embedded.coordinates.items` of the result is a Route.
+    from .gpxcompiler import Route
+
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+
+    start = _COORDINATES.search(content)
+    if start is not None:
+        # coordinate items hold no strings or nested arrays, so the first bracket closes the array
+        end = content.find(b"]", start.end())
+        try:
+            route = _parse_items(content[start.end():end], Route) if end >= 0 else None
+            if route is not None:
+                tour = loads(content[:start.end(1)] + _PLACEHOLDER + content[end + 1:])
+                coordinates = tour.get("_embedded", {}).get("coordinates", {})
+                if coordinates.get("items") == ["komootgpx:route"]:
+                    coordinates["items"] = route
+                    return tour
+        except (ValueError, TypeError):
+            pass
+
+    tour = loads(content)
+    coordinates = tour.get("_embedded", {}).get("coordinates")
+    if coordinates is not None and "items" in coordinates:
+        coordinates["items"] = Route.from_items(coordinates["items"])
+    return tour
+
+
+def _parse_items(items, route_class):
+    # Route of the raw items array (without brackets), or None if the items are not uniform
+    route = route_class()
+    items = items.strip()
+    if not items:
+        return route
+
+    skeleton = items.translate(None, _NUMBER_CHARS)
+    template = skeleton[:skeleton.find(b"}") + 1]
+    keys = _ITEM_KEYS.get(template)
+    if keys is None:
+        return None
+    count = items.count(b"{")
+    separator = b", " if skeleton.startswith(template + b", ") else b","
+    if skeleton != template + (separator + template) * (count - 1):
+        return None
+    values = loads(b"[" + items.translate(None, _KEY_CHARS) + b"]")
+    if len(values) != count * len(keys):
+        return None
+
+    # flags of the values written as JSON integers, see Route
+    all_int = 0
+    mixed = []
+    flags = {"lat": route_class.INT_LAT, "lng": route_class.INT_LNG, "alt": route_class.INT_ALT,
+             "t": route_class.INT_TIME}
+    for k, key in enumerate(keys):
+        column = values[k::len(keys)]
+        getattr(route, "time" if key == "t" else key).extend(column)
+        types = set(map(type, column))
+        if types == {int}:
+            all_int |= flags[key]
+        elif types != {float}:
+            if not types <= {int, float}:
+                return None
+            mixed.append((column, flags[key]))
+    route.int_flags = bytearray([all_int]) * count
+    for column, flag in mixed:
+        for i, value in enumerate(column):
+            if type(value) is int:
+                route.int_flags[i] |= flag
+
+    for name in ("alt", "time"):
+        if len(getattr(route, name)) == 0:
+            getattr(route, name).frombytes(bytes(8 * count))
+            setattr(route, name + "_valid", bytearray(count))
+        else:
+            setattr(route, name + "_valid", bytearray(b"\x01") * count)
+    return route
@@ -1,6 +1,14 @@
+import io
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 import gpxpy.gpx
+from gpxpy.gpxfield import format_time
+from gpxpy.utils import make_str
+
+from .simplify import simplify_indices
 
 category2type = dict(enumerate(["Generic", "Summit", "Valley", "Water", "Food", "Danger", "First aid", "Segment start", "Segment end",
 "Campsite", "Aid station", "Rest area", "Service", "Checkpoint", "Meeting point", "Toilet", "Gear", "Sharp curve",
@@ -33,6 +41,148 @@ class Point:
         return self.alt == self.CONST_UNDEFINED and self.time == self.CONST_UNDEFINED
 
 
+class Route:
+    # Track coordinates held as contiguous typed columns instead of one Point per coordinate.
+    # alt and time are only meaningful where alt_valid / time_valid are set. Values parsed from
+    # JSON integers are flagged in int_flags, so they are written out exactly as received.
+    INT_LAT, INT_LNG, INT_ALT, INT_TIME = 1, 2, 4, 8
+    COLUMNS = ("lat", "lng", "alt", "time", "alt_valid", "time_valid", "int_flags")
+
+    def __init__(self):
+        self.lat = array('d')
+        self.lng = array('d')
+        self.alt = array('d')
+        self.time = array('d')
+        self.alt_valid = bytearray()
+        self.time_valid = bytearray()
+        self.int_flags = bytearray()
+
+    @classmethod
+    def from_items(cls, items):
+        # single pass over `_embedded.coordinates.items`
+        if isinstance(items, Route):
+            # already decoded into columns by fastjson.decode_tour()
+            return items
+        route = cls()
+        lat_col, lng_col, alt_col, time_col = route.lat.append, route.lng.append, route.alt.append, route.time.append
+        alt_valid, time_valid, int_flags = route.alt_valid.append, route.time_valid.append, route.int_flags.append
+
+        for item in items:
+            flags = 0
+            if "lat" not in item and "lng" not in item:
+                lat = lng = Point.CONST_UNDEFINED
+                flags = cls.INT_LAT | cls.INT_LNG
+                item = {}
+            else:
+                lat = item["lat"]
+                lng = item["lng"]
+                if type(lat) is int:
+                    flags |= cls.INT_LAT
+                if type(lng) is int:
+                    flags |= cls.INT_LNG
+            lat_col(lat)
+            lng_col(lng)
+
+            alt = item.get("alt")
+            if alt is None:
+                alt_col(0.0)
+                alt_valid(0)
+            else:
+                alt_col(alt)
+                alt_valid(1)
+                if type(alt) is int:
+                    flags |= cls.INT_ALT
+
+            t = item.get("t")
+            if t is None:
+                time_col(0.0)
+                time_valid(0)
+            else:
+                time_col(t)
+                time_valid(1)
+                if type(t) is int:
+                    flags |= cls.INT_TIME
+
+            int_flags(flags)
+        return route
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __iter__(self):
+        # the points as `_embedded.coordinates.items` dicts, for code expecting the JSON shape
+        for lat, lng, alt, t, has_alt, has_time, flags in zip(*(getattr(self, name) for name in self.COLUMNS)):
+            if lat == Point.CONST_UNDEFINED and lng == Point.CONST_UNDEFINED:
+                yield {}
+                continue
+            item = {"lat": int(lat) if flags & self.INT_LAT else lat, "lng": int(lng) if flags & self.INT_LNG else lng}
+            if has_alt:
+                item["alt"] = int(alt) if flags & self.INT_ALT else alt
+            if has_time:
+                item["t"] = int(t) if flags & self.INT_TIME else t
+            yield item
+
+    def take(self, indices):
+        # new Route with the points at the given (ascending) indices
+        route = Route()
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            values = (column[i] for i in indices)
+            setattr(route, name, array(column.typecode, values) if isinstance(column, array) else bytearray(values))
+        return route
+
+
+_EPOCH = datetime(1970, 1, 1)
+_TWO_DIGITS = tuple(f"{i:02d}" for i in range(60))
+
+def iso_times(route, start_date, augment_timestamp):
+    # Yields the formatted <time> of every route point (None for points without time), matching
+    # gpxpy's format_time() of `start_date + timedelta(ms)` (augment_timestamp) or of the naive
+    # local `datetime.fromtimestamp(ms)`. Integer milliseconds are converted with integer arithmetic
+    # instead of building a datetime per point; the date/hour/minute prefix is reused per minute.
+    suffix = ""
+    base_us = 0
+    if augment_timestamp:
+        # the tour date has a fixed offset, so all points share the suffix of start_date
+        suffix = format_time(start_date.replace(microsecond=0))[19:]
+        base_us = (start_date.replace(tzinfo=None) - _EPOCH) // timedelta(microseconds=1)
+
+    localtime = time.localtime
+    last_bucket = None
+    offset = 0
+    last_minute = None
+    prefix = ""
+    for t, has_time, flags in zip(route.time, route.time_valid, route.int_flags):
+        if not has_time:
+            yield None
+            continue
+        if not flags & Route.INT_TIME:
+            # fractional milliseconds, leave the rounding to datetime
+            yield format_time(start_date + timedelta(seconds=t / 1000) if augment_timestamp
+                              else datetime.fromtimestamp(t / 1000))
+            continue
+
+        sec, us = divmod(base_us + int(t) * 1000, 1000000)
+        if not augment_timestamp:
+            # local wall clock time: the UTC offset is looked up once per 15 minute bucket,
+            # only buckets containing a DST transition need a lookup per point
+            bucket = sec // 900
+            if bucket != last_bucket:
+                last_bucket = bucket
+                first = localtime(bucket * 900).tm_gmtoff
+                offset = first if first == localtime(bucket * 900 + 899).tm_gmtoff else None
+            sec += localtime(sec).tm_gmtoff if offset is None else offset
+
+        minute = sec // 60
+        if minute != last_minute:
+            last_minute = minute
+            prefix = (_EPOCH + timedelta(minutes=minute)).isoformat()[:17]
+        if us:
+            yield f"{prefix}{_TWO_DIGITS[sec - minute * 60]}.{us:06d}{suffix}"
+        else:
+            yield prefix + _TWO_DIGITS[sec - minute * 60] + suffix
+
+
 class POI:
     def __init__(self, name, point, image_url, url, description, poitype):
         self.name = name
@@ -49,23 +199,44 @@ def extract_user_from_tip(json):
     return ""
 
 
+def fetch_highlight_tips(api, highlight_ids, max_workers):
+    # Fetch tips of all highlights concurrently, at most max_workers requests in flight.
+    # Returns a dict highlight id -> tips json; duplicate ids are fetched only once.
+    unique_ids = list(dict.fromkeys(highlight_ids))
+    if max_workers <= 1 or len(unique_ids) <= 1:
+        return {hid: api.fetch_highlight_tips(hid) for hid in unique_ids}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_ids))) as executor:
+        return dict(zip(unique_ids, executor.map(api.fetch_highlight_tips, unique_ids)))
+
+
 class GpxCompiler:
-    def __init__(self, tour, api, no_poi=False, max_desc_length=-1, karoo=False):
+    # number of formatted track point fragments buffered before they are written out
+    WRITE_CHUNK = 4096
+
+    def __init__(self, tour, api, no_poi=False, max_desc_length=-1, karoo=False, highlight_jobs=1,
+                 simplify_tolerance=None, max_points=None):
         self.api = api
         self.tour = tour
         self.no_poi = no_poi
         self.karoo = karoo
 
-        self.route = []
-        for coord in tour["_embedded"]["coordinates"]["items"]:
-            self.route.append(Point(coord))
+        self.route = Route.from_items(tour["_embedded"]["coordinates"]["items"])
+        if simplify_tolerance is not None or max_points is not None:
+            self.route = self.route.take(simplify_indices(self.route, simplify_tolerance, max_points))
 
         if self.no_poi:
             return
 
         self.pois = []
         if "timeline" in tour["_embedded"] and "_embedded" in tour["_embedded"]["timeline"]:
-            for item in tour["_embedded"]["timeline"]["_embedded"]["items"]:
+            timeline = tour["_embedded"]["timeline"]["_embedded"]["items"]
+
+            # enrich all highlights up front in one batch, POIs are still built in timeline order
+            highlight_ids = [str(item["_embedded"]["reference"]["id"]) for item in timeline if item["type"] == "highlight"]
+            highlight_tips = fetch_highlight_tips(self.api, highlight_ids, highlight_jobs)
+
+            for item in timeline:
                 if item["type"] != "poi" and item["type"] != "highlight" and item["type"] != "point":
                     continue
 
@@ -99,7 +270,7 @@ class GpxCompiler:
                         if "src" in ref["_embedded"]["front_image"]:
                             image_url = ref["_embedded"]["front_image"]["src"].split("?", 1)[0]
 
-                    tips = self.api.fetch_highlight_tips(str(ref["id"]))
+                    tips = highlight_tips[str(ref["id"])]
                     if "_embedded" in tips and "items" in tips["_embedded"]:
                         details += "\n――――――――――\n".join(str(extract_user_from_tip(x) + x["text"]) for x in tips["_embedded"]["items"])
 
@@ -135,6 +306,44 @@ class GpxCompiler:
                     self.pois.append(POI(name, point, '', '', details, poitype))
 
     def generate(self):
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def write(self, f):
+        # Streams the GPX document to the text file f. Metadata and waypoints are serialized by gpxpy,
+        # track points are formatted directly, so no GPXTrackPoint objects are built for the route.
+        document = self._build_gpx().to_xml()
+
+        # the single track segment is empty, split the document right before its closing tag
+        split = document.rindex("\n    </trkseg>")
+        f.write(document[:split])
+
+        route = self.route
+        augment_timestamp = route.time_valid[0] and route.time[0] == 0
+        start_date = datetime.strptime(self.tour['date'], "%Y-%m-%dT%H:%M:%S.%f%z")
+
+        chunk = []
+        for lat, lng, alt, has_alt, flags, iso_time in zip(route.lat, route.lng, route.alt, route.alt_valid,
+                                                           route.int_flags, iso_times(route, start_date, augment_timestamp)):
+            lat = str(int(lat)) if flags & Route.INT_LAT else make_str(lat)
+            lng = str(int(lng)) if flags & Route.INT_LNG else make_str(lng)
+            chunk.append(f'\n      <trkpt lat="{lat}" lon="{lng}">')
+            if has_alt:
+                chunk.append(f'\n        <ele>{str(int(alt)) if flags & Route.INT_ALT else make_str(alt)}</ele>')
+            if iso_time is not None:
+                chunk.append(f'\n        <time>{iso_time}</time>')
+            chunk.append('\n      </trkpt>')
+
+            if len(chunk) >= self.WRITE_CHUNK:
+                f.write(''.join(chunk))
+                chunk.clear()
+
+        f.write(''.join(chunk))
+        f.write(document[split:])
+
+    def _build_gpx(self):
+        # everything but the track points
         gpx = gpxpy.gpx.GPX()
         gpx.name = self.tour["name"]
         if self.tour['type'] == "tour_recorded":
@@ -166,20 +375,6 @@ class GpxCompiler:
         segment = gpxpy.gpx.GPXTrackSegment()
         track.segments.append(segment)
 
-        augment_timestamp = self.route[0].time == 0
-        start_date = datetime.strptime(self.tour['date'], "%Y-%m-%dT%H:%M:%S.%f%z")
-
-        for coord in self.route:
-            point = gpxpy.gpx.GPXTrackPoint(coord.lat, coord.lng)
-            if coord.alt != coord.CONST_UNDEFINED:
-                point.elevation = coord.alt
-            if coord.time != coord.CONST_UNDEFINED:
-                if augment_timestamp:
-                    point.time = start_date + timedelta(seconds=coord.time / 1000)
-                else:
-                    point.time = datetime.fromtimestamp(coord.time / 1000)
-            segment.points.append(point)
-
         if not self.no_poi:
             for poi in self.pois:
                 wp = gpxpy.gpx.GPXWaypoint(poi.point.lat, poi.point.lng)
@@ -204,4 +399,4 @@ class GpxCompiler:
 
                 gpx.waypoints.append(wp)
 
-        return gpx.to_xml()
+        return gpx
@@ -1,14 +1,152 @@
-import requests
 from datetime import datetime
 from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
+from contextlib import contextmanager
+import hashlib
+import os
 import piexif
+import struct
 import tempfile
-import shutil
+import threading
+import time
 from io import BytesIO
 from PIL import Image
+from .api import conditional_headers
 from .utils import *
 
+CHUNK_SIZE = 64 * 1024
+
+class ImageTooLargeError(Exception):
+    pass
+
+class ExifSplicer:
+    # Writes a JPEG stream to f with Exif inserted like piexif.insert does, in a single pass:
+    # a leading APP0 (JFIF) and/or Exif APP1 segment is replaced by the new Exif segment,
+    # everything after it is passed through unchanged. Only the first segments are buffered.
+
+    def __init__(self, f, exif_bytes: bytes):
+        if exif_bytes[0:6] != b"Exif\x00\x00":
+            raise ValueError("Given data is not exif data")
+        self.f = f
+        self.exif = b"\xff\xe1" + struct.pack(">H", len(exif_bytes) + 2) + exif_bytes
+        self._head = bytearray()
+
+    def write(self, chunk):
+        if self._head is None:
+            self.f.write(chunk)
+            return
+        self._head += chunk
+        resume = self._resume_offset()
+        if resume is not None:
+            self.f.write(b"\xff\xd8")
+            self.f.write(self.exif)
+            self.f.write(self._head[resume:])
+            self._head = None
+
+    def close(self):
+        if self._head is not None:
+            raise piexif.InvalidImageDataError("Wrong JPEG data.")
+
+    def _segment(self, pos):
+        # (end, is_exif) of the segment at pos, None if it is not buffered completely yet
+        head = self._head
+        if len(head) < pos + 4:
+            return None
+        if head[pos:pos + 2] == b"\xff\xda":
+            # start of scan, the image data follows
+            return pos, False
+        end = pos + 2 + struct.unpack(">H", head[pos + 2:pos + 4])[0]
+        if len(head) < end:
+            return None
+        return end, head[pos:pos + 2] == b"\xff\xe1" and head[pos + 4:pos + 10] == b"Exif\x00\x00"
+
+    def _resume_offset(self):
+        # offset in the buffered head where the original stream is continued, None if undecided
+        head = self._head
+        if len(head) < 2:
+            return None
+        if head[0:2] != b"\xff\xd8":
+            raise piexif.InvalidImageDataError("Given data isn't JPEG.")
+        first = self._segment(2)
+        if first is None:
+            return None
+        if head[2:4] == b"\xff\xe0":
+            second = self._segment(first[0])
+            if second is None:
+                return None
+            return second[0] if second[1] else first[0]
+        return first[0] if first[1] else 2
+
+def temp_file_beside(output_path: str, suffix: str = ".part"):
+    # hidden temp file in the target directory, so it can be renamed over the target without copying
+    directory, name = os.path.split(output_path)
+    return tempfile.NamedTemporaryFile(dir=directory or ".", prefix=f".{name}.", suffix=suffix, delete=False)
+
+@contextmanager
+def atomic_output(output_path: str):
+    # the target is replaced only once the temp file was written completely
+    tmp = temp_file_beside(output_path)
+    try:
+        with tmp:
+            yield tmp
+        os.replace(tmp.name, output_path)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+def png_to_jpeg(png_path: str, exif_bytes: bytes, jpeg_quality: int, output_path: str) -> str:
+    # CPU-bound part of saving an image; module level so it can run in a ProcessPoolExecutor.
+    # Returns the SHA-256 digest of the written JPEG.
+    img = Image.open(png_path)
+
+    # Handle transparency correctly
+    if img.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    else:
+        img = img.convert("RGB")
+
+    out = BytesIO()
+    img.save(
+        out,
+        format="JPEG",
+        quality=jpeg_quality,
+        subsampling=0,
+        optimize=True,
+    )
+
+    with atomic_output(output_path) as f:
+        writer = HashingWriter(f)
+        splicer = ExifSplicer(writer, exif_bytes)
+        splicer.write(out.getbuffer())
+        splicer.close()
+    return writer.hexdigest()
+
+class PngConverterPool:
+    # Process pool for png_to_jpeg(), started on the first PNG instead of for every run.
+    # Workers are spawned rather than forked: forking while the download threads are
+    # running can deadlock the child.
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self._pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool.submit(fn, *args)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
 class ImageDownloaderWithExif:
     def __init__(
         self,
@@ -21,6 +159,7 @@ class ImageDownloaderWithExif:
         creator: str = "",
         timezone: str = "UTC",
         jpeg_quality: int = 90,
+        max_size: int = None,
     ):
         self.api = api
         self.no_poi = no_poi
@@ -34,66 +173,95 @@ class ImageDownloaderWithExif:
         self.highlight_id = image_data.get('highlight_id', None)
         self.timezone = ZoneInfo(timezone)
         self.jpeg_quality = jpeg_quality
+        self.max_size = max_size
+        # SHA-256 of the saved file and bytes downloaded, set by download_and_save
+        self.digest = None
+        self._received = 0
 
     # ---------- public API ----------
 
-    def download_and_save(self, output_path: str) -> str:
-        image_bytes, is_png = self._download_image_bytes()
+    def download_and_save(self, output_path: str, process_pool=None, existing: bool = None) -> str:
+        # returns the path of the saved image, or None if the existing image is still up to date
+        # existing tells whether the image was saved before, by default whether output_path is a file
+        # the Exif data is spliced in while streaming, so it has to be complete before the download
         if self.highlight_id:
             highlight = self.api.fetch_highlight(highlight_id=self.highlight_id, silent=True)
             self.name = highlight.get('base_name', '')
             self.creator_display_name = highlight.get('_embedded', {}).get('creator', {}).get('display_name', '')
 
-        if is_png:
-            image_bytes = self._png_to_jpeg(image_bytes)
-
         exif_bytes = self._build_exif()
 
-        # piexif works on files only -> temp file
-        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
-            tmp.write(image_bytes)
-            tmp.flush()
-            tmp_name = tmp.name
+        # an existing image is only revalidated if it would get the very same Exif data
+        exif_digest = hashlib.sha256(exif_bytes).hexdigest()
+        url = self._strip_url_params(self.src)
+        validators = None
+        if existing is None:
+            existing = os.path.isfile(output_path)
+        if existing:
+            validators = self.api.cached_validators("image", url)
+            if validators is not None and validators.get("exif") != exif_digest:
+                validators = None
+
+        start = time.perf_counter()
+        self._received = 0
+        status = None
+        try:
+            with self.api.session.get(url, stream=True, timeout=15, headers=conditional_headers(validators)) as resp:
+                status = resp.status_code
+                if validators is not None and resp.status_code == 304:
+                    return None
+                resp.raise_for_status()
+
+                content_type = resp.headers.get("Content-Type", "").lower()
+                is_png = "image/png" in content_type or url.lower().endswith(".png")
+
+                content_length = resp.headers.get("Content-Length")
+                if content_length and content_length.isdigit():
+                    self._check_size(int(content_length))
 
-        piexif.insert(exif_bytes, tmp_name)
-        shutil.move(tmp_name, output_path)
+                if not is_png:
+                    with atomic_output(output_path) as f:
+                        writer = HashingWriter(f)
+                        splicer = ExifSplicer(writer, exif_bytes)
+                        self._stream_to(resp, splicer)
+                        splicer.close()
+                    self.digest = writer.hexdigest()
+                    self.api.store_validators("image", url, resp, exif=exif_digest)
+                    return output_path
 
+                # PNGs are converted to JPEG, which needs the whole image decoded anyway
+                png = temp_file_beside(output_path, suffix=".png.part")
+                try:
+                    with png:
+                        self._stream_to(resp, png)
+                except BaseException:
+                    os.unlink(png.name)
+                    raise
+        finally:
+            self.api.metrics.record_request("images", status, time.perf_counter() - start, self._received)
+
+        try:
+            args = (png.name, exif_bytes, self.jpeg_quality, output_path)
+            if process_pool is None:
+                self.digest = png_to_jpeg(*args)
+            else:
+                self.digest = process_pool.submit(png_to_jpeg, *args).result()
+        finally:
+            os.unlink(png.name)
+        self.api.store_validators("image", url, resp, exif=exif_digest)
         return output_path
 
     # ---------- downloading ----------
 
-    def _download_image_bytes(self) -> tuple[bytes, bool]:
-        url = self._strip_url_params(self.src)
-        resp = requests.get(url, timeout=15)
-        resp.raise_for_status()
-
-        content_type = resp.headers.get("Content-Type", "").lower()
-        is_png = "image/png" in content_type or url.lower().endswith(".png")
-
-        return resp.content, is_png
-
-    # ---------- PNG -> JPEG ----------
-
-    def _png_to_jpeg(self, png_bytes: bytes) -> bytes:
-        img = Image.open(BytesIO(png_bytes))
-
-        # Handle transparency correctly
-        if img.mode in ("RGBA", "LA"):
-            background = Image.new("RGB", img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[-1])
-            img = background
-        else:
-            img = img.convert("RGB")
-
-        out = BytesIO()
-        img.save(
-            out,
-            format="JPEG",
-            quality=self.jpeg_quality,
-            subsampling=0,
-            optimize=True,
-        )
-        return out.getvalue()
+    def _stream_to(self, resp, f):
+        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+            self._received += len(chunk)
+            self._check_size(self._received)
+            f.write(chunk)
+
+    def _check_size(self, size: int):
+        if self.max_size is not None and size > self.max_size:
+            raise ImageTooLargeError(f"image {self.id} exceeds the maximum size of {self.max_size} bytes")
 
     # ---------- EXIF ----------
 
@@ -1,44 +1,67 @@
+import atexit
 import os
 import re
 import sys
-import argparse
-import configargparse
 import json
 import hashlib
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, fields
 from datetime import datetime
+from functools import lru_cache
 
-from platformdirs import user_cache_dir
-from colorama import init as colorama_init
-
-from .api import KomootApi
-from .gpxcompiler import GpxCompiler
-from .imagedownload import ImageDownloaderWithExif
+from .metrics import Metrics
 from .utils import *
 from .__version__ import __version__
 
+# Importing this module has no side effects and loads no heavy dependencies: requests, gpxpy,
+# Pillow and friends are imported where they are first needed, the cache directory is created
+# on first use and the remaining setup happens in entrypoint(). Keeps --version and --help fast.
+
 # in minutes
 SESSION_TTL = 15
 
-def _get_cache_dir():
-    return user_cache_dir("komootgpx", ensure_exists=True)
-
-CREDFILE = os.path.join(_get_cache_dir(), "credentials.json")
-HASHFILE = os.path.join(_get_cache_dir(), "komootgpx-hashes.json")
+# file names in the cache directory, see cache_file(); CREDFILE and HASHFILE are their full paths
+CREDFILE_NAME = "credentials.json"
+STATEFILE_NAME = "komootgpx-state.sqlite"
+HIGHLIGHT_CACHEFILE_NAME = "highlights.sqlite"
+RESPONSE_CACHEFILE_NAME = "responses.sqlite"
+# legacy JSON state, migrated into the state database on first use
+HASHFILE_NAME = "komootgpx-hashes.json"
 CONFIGFILE = "config.yaml"
 
-# Migrate credentials from old working-dir location to cache dir,
-# only if the new location does not exist yet.
-_old_credfile = "credentials.json"
-if os.path.isfile(_old_credfile) and not os.path.isfile(CREDFILE):
-    shutil.move(_old_credfile, CREDFILE)
-
-colorama_init()
 interactive_info_shown = False
 
 output_dir_contents = set()
 
+@lru_cache(maxsize=None)
+def _get_cache_dir():
+    from platformdirs import user_cache_dir
+    return user_cache_dir("komootgpx", ensure_exists=True)
+
+def cache_file(name):
+    return os.path.join(_get_cache_dir(), name)
+
+# paths of the files in the cache directory, resolved on first access since that creates the directory
+_CACHE_PATHS = {"CREDFILE": CREDFILE_NAME, "HASHFILE": HASHFILE_NAME}
+# public classes of the package, imported on first access since they load the heavy dependencies
+_LAZY_CLASSES = {"KomootApi": ".api", "GpxCompiler": ".gpxcompiler", "ImageDownloaderWithExif": ".imagedownload"}
+
+def __getattr__(name):
+    if name in _CACHE_PATHS:
+        return cache_file(_CACHE_PATHS[name])
+    if name in _LAZY_CLASSES:
+        import importlib
+        return getattr(importlib.import_module(_LAZY_CLASSES[name], __package__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def migrate_credentials():
+    # Migrate credentials from old working-dir location to cache dir,
+    # only if the new location does not exist yet.
+    old_credfile = "credentials.json"
+    if os.path.isfile(old_credfile) and not os.path.isfile(cache_file(CREDFILE_NAME)):
+        shutil.move(old_credfile, cache_file(CREDFILE_NAME))
+
 def usage():
     print(bcolor.HEADER + bcolor.BOLD + 'komootgpx.py [options]' + bcolor.ENDC)
 
@@ -53,13 +76,15 @@ def usage():
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-a', '--make-all', 'Download all tours'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-R', '--recent=N', 'Download the N most recently changed tours'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-s', '--skip-existing', 'Do not download and save GPX if the file already exists, ignored with -d'))
-    print('\t{:<2s}, {:<30s} {:<10s}'.format('-S', '--skip-unchanged', 'Do not download and save GPX if the tour has not changed since last download (hash verification), ignored with -d and -s'))
-    print('\t{:<2s}, {:<30s} {:<10s}'.format('-r', '--remove-deleted', 'Remove GPX files (from --output dir) without corresponding tour in Komoot (deleted and previous versions)'))
+    print('\t{:<2s}, {:<30s} {:<10s}'.format('-S', '--skip-unchanged', 'Do not download and save GPX and images if the tour has not changed since last download (hash verification), ignored with -d and -s'))
+    print('\t{:<34s} {:<10s}'.format('--incremental', 'With -a, only list and download tours changed since the last successful run'))
+    print('\t{:<2s}, {:<30s} {:<10s}'.format('-r', '--remove-deleted', 'Remove GPX files (from --output dir) and tour images without corresponding tour or image in Komoot (deleted and previous versions)'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-f', '--filename-pattern=pattern', 'Specify filename pattern, default: "{title}-{id}.gpx", available fields: title, id, date, time'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-I', '--id-filename', 'Use only tour id for filename (no title), equal to -f "{id}.gpx"'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-D', '--add-date', 'Add tour date to file name, equal to -f "{date}_{title}-{id}.gpx"'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-L', '--language', 'Select description language (fr, de, en..., default: en)'))
     print('\t{:<34s} {:<10s}'.format('--max-title-length=num', 'Crop title used in filename to given length (default: -1 = no limit)'))
+    print('\t{:<2s}, {:<30s} {:<10s}'.format('-j', '--jobs=num', 'Export up to num tours concurrently with -a/-R (default: 1)'))
 
     print('\n' + bcolor.OKBLUE + '[Filters]' + bcolor.ENDC)
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-t', '--tour-type=type', 'Filter by track type ("planned", "recorded" or "all")'))
@@ -71,18 +96,41 @@ def usage():
 
     print('\n' + bcolor.OKBLUE + '[Generator]' + bcolor.ENDC)
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-o', '--output=directory', 'Output directory (default: working directory)'))
+    print('\t{:<34s} {:<10s}'.format('--gzip', 'Write gzip compressed .gpx.gz files'))
+    print('\t{:<34s} {:<10s}'.format('--archive=file', 'Write all tours (and images) into a single .zip, .tar or .tar.gz archive instead of --output. New members are appended, changed or removed ones rewrite the whole archive (a .tar.gz on any change)'))
+    print('\t{:<34s} {:<10s}'.format('--analytics=directory', 'Also export route points and tour metadata as Parquet files to given directory, updated as tours change (requires pyarrow)'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-e', '--poi', 'Include highlights as POIs (default behavior)'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-e', '--no-poi', 'Do not include highlights as POIs'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-K', '--karoo', 'Save all POIs with Generic type (Hammerhead Karoo import compatibility)'))
     print('\t{:<34s} {:<10s}'.format('--max-desc-length=count', 'Limit description length in characters (default: -1 = no limit)'))
+    print('\t{:<34s} {:<10s}'.format('--simplify=meters', 'Simplify the track, dropping points deviating less than given meters (optional)'))
+    print('\t{:<34s} {:<10s}'.format('--max-points=num', 'Simplify the track to at most num points, e.g. for head units (optional)'))
+    print('\t{:<34s} {:<10s}'.format('--highlight-jobs=num', 'Fetch up to num highlight tips of a tour concurrently (default: 4)'))
+    print('\t{:<34s} {:<10s}'.format('--highlight-cache-ttl=hours', 'Reuse cached highlights and tips for given hours (default: 168, 0 = no cache)'))
+    print('\t{:<34s} {:<10s}'.format('--highlight-cache-size=num', 'Keep at most num cached highlight entries, least recently used are evicted (default: 10000)'))
 
     print('\n' + bcolor.OKBLUE + '[Images]' + bcolor.ENDC)
     print('\t{:<34s} {:<10s}'.format('--all-images', 'Download images from other users too - please review the copyright'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-i', '--add-images', 'Add tour images'))
+    print('\t{:<34s} {:<10s}'.format('--max-image-size=MB', 'Skip images larger than given size in megabytes (optional)'))
+    print('\t{:<34s} {:<10s}'.format('--image-jobs=num', 'Download and process up to num images of a tour concurrently (default: 4)'))
+
+    print('\n' + bcolor.OKBLUE + '[Network]' + bcolor.ENDC)
+    print('\t{:<34s} {:<10s}'.format('--api-url=url', 'Base URL of the Komoot API, e.g. a local mock server (default: https://api.komoot.de)'))
+    print('\t{:<34s} {:<10s}'.format('--pool-size=num', 'Maximum number of pooled keep-alive connections (default: 10)'))
+    print('\t{:<34s} {:<10s}'.format('--retries=num', 'Retry failed and throttled (5xx, 429) requests up to num times (default: 3)'))
+    print('\t{:<34s} {:<10s}'.format('--max-rate=num', 'Send at most num requests per second, lowered automatically when throttled (optional)'))
+    print('\t{:<34s} {:<10s}'.format('--retry-backoff=sec', 'Exponential backoff factor between retries in seconds (default: 0.5)'))
+    print('\t{:<34s} {:<10s}'.format('--http-cache-ttl=hours', 'Revalidate tours and images with conditional requests for given hours (default: 720, 0 = always download)'))
+    print('\t{:<34s} {:<10s}'.format('--http-cache-size=MB', 'Keep at most MB megabytes of cached responses, which hold the full tour JSON (default: 100)'))
 
     print('\n' + bcolor.OKBLUE + '[Other]' + bcolor.ENDC)
-    print('\t{:<34s} {:<10s}'.format('--debug', 'Save all Komoot API responses in set of .txt files'))
-    print('\t{:<34s} {:<10s}'.format('--clear-cache', 'Remove cached credentials and file hashes'))
+    print('\t{:<34s} {:<10s}'.format('--debug', 'Print effective settings, every API request and cache statistics'))
+    print('\t{:<34s} {:<10s}'.format('--record=file', 'Record all API requests and responses to given archive (.jsonl.gz)'))
+    print('\t{:<34s} {:<10s}'.format('--replay=file', 'Serve all API requests from an archive of --record, without network access'))
+    print('\t{:<34s} {:<10s}'.format('--stats', 'Print run statistics (phase timings, requests, caches) at exit'))
+    print('\t{:<34s} {:<10s}'.format('--metrics-file=file', 'Write run statistics as JSON to given file at exit'))
+    print('\t{:<34s} {:<10s}'.format('--clear-cache', 'Remove cached credentials, file hashes and highlights'))
     print('\t{:<2s}, {:<30s} {:<10s}'.format('-v', '--version', 'Print version and exit'))
 
 
@@ -180,8 +228,10 @@ def notify_interactive():
 class RunConfig:
     # Run-wide configuration, built once in main() after args/config merging.
     # Only tour_id and tour_base vary between make_gpx/download_tour_images
-    api: KomootApi
-    output_dir: str
+    api: "KomootApi"
+    state: "StateStore"
+    output: "DirectoryOutput"
+    analytics: "AnalyticsDataset"
     filename_pattern: str
     image_dir_pattern: str
     no_poi: bool
@@ -193,113 +243,144 @@ class RunConfig:
     all_images: bool
     language: str
     karoo: bool
-
-def make_gpx(cfg, tour_id, tour_base):
-    tour = None
-    if tour_base is None:
-        tour_base = cfg.api.fetch_tour(str(tour_id), language=cfg.language)
-        tour = tour_base
-
-    tour_changed_at = parse_date_str(tour_base['changed_at']).timestamp()
-    tour_hash = hashlib.md5(tour_base['changed_at'].encode()).hexdigest()
-
-    hashpath = HASHFILE
-    hashes = {}
-    if os.path.exists(hashpath):
-        with open(hashpath, "r", encoding="utf-8") as f:
-            hashes = json.load(f)
-
+    highlight_jobs: int
+    simplify: float
+    max_points: int
+    image_jobs: int
+    max_image_size: int
+    image_pool: "PngConverterPool"
+    metrics: Metrics
+
+def watermark_key(user_id, args):
+    # a watermark is only valid for the exact same selection written to the same place
+    target = os.path.abspath(args.archive or args.output) + (" (gzip)" if args.gzip else "")
+    return "watermark:" + json.dumps([user_id, target, args.tour_type, args.sport,
+                                      str(args.start_date), str(args.end_date), args.private_only, args.public_only])
+
+def format_tour_filename(pattern, tour_id, tour_base, max_title_length):
+    # Fills a filename pattern (fields: title, id, date, time) for a tour, used for GPX files and image directories
     file_title = sanitize_filename(tour_base['name'])
-    if cfg.max_title_length == 0:
+    if max_title_length == 0:
         file_title = ""
-    elif cfg.max_title_length > 0 and len(file_title) > cfg.max_title_length:
-        file_title = file_title[:cfg.max_title_length]
+    elif max_title_length > 0 and len(file_title) > max_title_length:
+        file_title = file_title[:max_title_length]
 
-    filename = cfg.filename_pattern.format(
+    filename = pattern.format(
         date = tour_base['date'][:10],
         time = re.sub(r'.*T(\d+):(\d+):(\d+).*', '\1:\2:\3', tour_base['date']),
         title = file_title,
         id = tour_id
         )
 
-    fullname = sanitize_filename(filename)
-    path = f"{cfg.output_dir}/{fullname}"
+    return sanitize_filename(filename)
+
+def make_gpx(cfg, tour_id, tour_base):
+    # returns the full tour if it was fetched, so it can be reused
+    tour = None
+    if tour_base is None:
+        with cfg.metrics.phase("fetch"):
+            tour_base = cfg.api.fetch_tour(str(tour_id), language=cfg.language)
+        tour = tour_base
+
+    tour_changed_at = parse_date_str(tour_base['changed_at']).timestamp()
+    tour_hash = hashlib.md5(tour_base['changed_at'].encode()).hexdigest()
+
+    fullname = format_tour_filename(cfg.filename_pattern, tour_id, tour_base, cfg.max_title_length)
+    path = cfg.output.path(fullname)
 
     if cfg.remove_deleted:
-        if fullname in output_dir_contents:
-            output_dir_contents.remove(fullname)
+        output_dir_contents.discard(fullname)
 
-    if cfg.skip_existing and os.path.exists(path):
+    if cfg.skip_existing and cfg.output.exists(path):
         print_success(f"{tour_base['name']} skipped - already exists at '{path}'")
-        return
-
-    if cfg.skip_unchanged and os.path.exists(path):
-        if hashes.get(str(tour_id)) == tour_hash:
+        cfg.metrics.count("tours_skipped_existing")
+        return tour
+
+    if cfg.skip_unchanged and cfg.output.exists(path):
+        state = cfg.state.tour(tour_id)
+        # a recorded size also catches files that were truncated or edited since the export
+        if state is not None and state["changed_hash"] == tour_hash and \
+                state["size"] in (None, cfg.output.size(path)):
             print_success(f"{tour_base['name']} skipped - unchanged at '{path}'")
-            return
+            cfg.metrics.count("tours_skipped_unchanged")
+            return tour
 
     if tour is None:
-        tour = cfg.api.fetch_tour(str(tour_id), language=cfg.language)
+        with cfg.metrics.phase("fetch"):
+            tour = cfg.api.fetch_tour(str(tour_id), language=cfg.language)
+
+    from .gpxcompiler import GpxCompiler
 
-    gpx = GpxCompiler(tour, cfg.api, cfg.no_poi, cfg.max_desc_length, cfg.karoo)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(gpx.generate())
+    with cfg.metrics.phase("compile"):
+        gpx = GpxCompiler(tour, cfg.api, cfg.no_poi, cfg.max_desc_length, cfg.karoo, cfg.highlight_jobs,
+                          cfg.simplify, cfg.max_points)
 
-    # set file mtime/atime to the value of `changed_at` property of tour
-    os.utime(path, (tour_changed_at, tour_changed_at))
+    with cfg.metrics.phase("write"):
+        # the file (or archive member) gets the mtime of the tour's `changed_at` property
+        with cfg.output.write_text(path, tour_changed_at) as f:
+            writer = HashingWriter(f)
+            gpx.write(writer)
 
-    hashes[str(tour_id)] = tour_hash
-    with open(hashpath, "w", encoding="utf-8") as f:
-        json.dump(hashes, f)
+        cfg.state.record_tour(tour_id, tour_base['changed_at'], tour_hash, path, cfg.output.size(path),
+                              writer.hexdigest())
 
     print_success(f"GPX file written to '{path}'")
+    cfg.metrics.count("tours_written")
+    return tour
+
+def add_tour_analytics(cfg, tour_id, tour_base, tour):
+    # the dataset keeps the changed_at of every tour, so unchanged tours are neither fetched nor rewritten
+    if tour_base is None:
+        tour_base = tour
+    if cfg.analytics.is_current(tour_id, tour_base['changed_at']):
+        cfg.metrics.count("analytics_tours_unchanged")
+        return
+
+    if tour is None:
+        with cfg.metrics.phase("fetch"):
+            tour = cfg.api.fetch_tour(str(tour_id), language=cfg.language)
+    cfg.analytics.add(tour)
+    cfg.metrics.count("analytics_tours_added")
 
 def download_tour_images(cfg, tour_id, tour_base):
+    # returns False if an image could not be saved, so the tour has to be handled again
+    from .imagedownload import ImageDownloaderWithExif, ImageTooLargeError
+
     if tour_base is None:
         tour_base = cfg.api.fetch_tour(str(tour_id), language=cfg.language)
 
+    image_dir_name = format_tour_filename(cfg.image_dir_pattern, tour_id, tour_base, cfg.max_title_length)
+    image_dir = cfg.output.path(image_dir_name)
+
+    # images are part of the tour, adding or deleting one changes the tour's changed_at
+    images_hash = hashlib.md5(json.dumps([tour_base['changed_at'], image_dir, cfg.no_poi, cfg.all_images,
+                                          cfg.api.display_name]).encode()).hexdigest()
+    manifest_hash, manifest = cfg.state.images(tour_id, cfg.output.target)
+    if cfg.skip_unchanged and manifest_hash == images_hash and \
+            all(cfg.output.isfile(record["path"]) for record in manifest.values()):
+        print_success(f"Images of {tour_base['name']} skipped - unchanged in '{image_dir}'")
+        cfg.metrics.count("image_tours_skipped_unchanged")
+        return True
+
     image_dir_contents = set()
     images = cfg.api.fetch_tour_images(str(tour_id), silent=False)
 
-    if len(images) > 0:
-
-        file_title = sanitize_filename(tour_base['name'])
-        if cfg.max_title_length == 0:
-            file_title = ""
-        elif cfg.max_title_length > 0 and len(file_title) > cfg.max_title_length:
-            file_title = file_title[:cfg.max_title_length]
-
-        image_dir_name = cfg.image_dir_pattern.format(
-            date = tour_base['date'][:10],
-            time = re.sub(r'.*T(\d+):(\d+):(\d+).*', '\1:\2:\3', tour_base['date']),
-            title = file_title,
-            id = tour_id
-            )
-
-        image_dir_name = sanitize_filename(image_dir_name)
-        image_dir = f"{cfg.output_dir}/{image_dir_name}"
-
-        if os.path.exists(image_dir):
-            imagepat = re.compile(r"\.jpg$")
-            for f in os.listdir(image_dir):
-                if not os.path.isfile(f) or not imagepat.match(f):
-                    continue
+    if cfg.remove_deleted:
+        imagepat = re.compile(r"\.jpg$")
+        for f in cfg.output.listdir(image_dir):
+            if imagepat.search(f):
                 image_dir_contents.add(f)
+        # files recorded in the manifest are only removed after checking their digest, below
+        for record in manifest.values():
+            if os.path.dirname(record["path"]) == image_dir:
+                image_dir_contents.discard(os.path.basename(record["path"]))
 
+    saved = {}
+    pending = []
     for x in images:
         creator_display_name = images[x].get('_embedded', {}).get('creator', {}).get('display_name', "")
         highlight_id = images[x].get('highlight_id', None)
         iid = images[x].get('id')
-        if highlight_id and cfg.no_poi:
-            print_success(f"Also skipped image download for highlight/poi: {highlight_id} (--no-poi)")
-            continue
-
-        if not cfg.all_images and creator_display_name != cfg.api.display_name:
-            print_success(f"Image download skipped for image {iid} from: {creator_display_name} - it doesn't belong to user {cfg.api.display_name}")
-            continue
-
-        if not os.path.exists(image_dir):
-            os.makedirs(image_dir)
 
         third_party_copyright = ''
         if creator_display_name != cfg.api.display_name:
@@ -309,12 +390,26 @@ def download_tour_images(cfg, tour_id, tour_base):
         filename = sanitize_filename(output_date + "-hl" + str(x) + third_party_copyright + ".jpg")
 
         path = f"{image_dir}/{filename}"
+        # still in Komoot: --remove-deleted keeps the file, even if the image is not selected this time
+        image_dir_contents.discard(filename)
+
+        if highlight_id and cfg.no_poi:
+            print_success(f"Also skipped image download for highlight/poi: {highlight_id} (--no-poi)")
+            continue
+
+        if not cfg.all_images and creator_display_name != cfg.api.display_name:
+            print_success(f"Image download skipped for image {iid} from: {creator_display_name} - it doesn't belong to user {cfg.api.display_name}")
+            continue
 
-        if filename in image_dir_contents:
-            image_dir_contents.remove(filename)
+        # the digest of a file kept as it is stays the one recorded when it was saved
+        previous = manifest.get(str(x))
+        record = {"src": images[x]['src'], "created_at": images[x]['created_at'], "path": path,
+                  "digest": previous["digest"] if previous is not None and previous["path"] == path else None}
 
-        if cfg.skip_existing and os.path.exists(path):
+        if cfg.skip_existing and cfg.output.exists(path):
             print_success(f"image download skipped - id {x} already exists at '{path}'")
+            cfg.metrics.count("images_skipped_existing")
+            saved[str(x)] = record
             continue
 
         downloader = ImageDownloaderWithExif(
@@ -322,17 +417,130 @@ def download_tour_images(cfg, tour_id, tour_base):
             cfg.api,
             cfg.no_poi,
             cfg.all_images,
-            timezone="UTC"
+            timezone="UTC",
+            max_size=cfg.max_image_size
         )
 
-        saved_image = downloader.download_and_save(path)
+        pending.append((x, downloader, record))
+
+    def save_image(x, downloader, record):
+        # returns the record of the saved image, False if it was skipped or None if it failed
+        # a single broken image must not abort the remaining images or tours
+        path = record["path"]
+        try:
+            staged = cfg.output.staging_path(path)
+            saved_image = downloader.download_and_save(staged, process_pool=cfg.image_pool,
+                                                       existing=cfg.output.isfile(path))
+            if saved_image:
+                cfg.output.commit(path, staged, parse_date_str(record["created_at"]).timestamp())
+        except ImageTooLargeError as e:
+            # skipped on purpose, the images of the tour are still complete
+            print_success(f"Image download skipped - {e}")
+            cfg.metrics.count("images_skipped_too_large")
+            return False
+        except Exception as e:
+            print_error(f"Failed to save image {x} to '{shorten_path(path, 120)}': {e}")
+            cfg.metrics.count("images_failed")
+            return None
         if saved_image:
-            print_success(f"Saved {shorten_path(saved_image, 120)}")
+            record["digest"] = downloader.digest
+            print_success(f"Saved {shorten_path(path, 120)}")
+            cfg.metrics.count("images_written")
+        else:
+            print_success(f"Image {x} not modified, kept '{shorten_path(path, 120)}'")
+            cfg.metrics.count("images_not_modified")
+        return record
 
-def main(args):
-    output_dir = args.output
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+    if cfg.image_jobs <= 1 or len(pending) <= 1:
+        results = [save_image(*task) for task in pending]
+    else:
+        with ThreadPoolExecutor(max_workers=min(cfg.image_jobs, len(pending))) as executor:
+            results = [future.result() for future in [executor.submit(save_image, *task) for task in pending]]
+
+    complete = True
+    for (x, _, _), record in zip(pending, results):
+        if record is None:
+            complete = False
+        elif record is not False:
+            saved[str(x)] = record
+
+    # with --remove-deleted, images deleted in Komoot (or saved under another name since): remove
+    # the files a previous run saved to this image directory, unless they were modified locally
+    upstream = {str(x) for x in images}
+    paths = {record["path"] for record in saved.values()}
+    for image_id, record in manifest.items():
+        stale_path = record["path"]
+        if not cfg.remove_deleted or os.path.dirname(stale_path) != image_dir:
+            continue
+        if stale_path in paths or not cfg.output.isfile(stale_path):
+            continue
+        if image_id in upstream and image_id not in saved:
+            continue  # still in Komoot, only not selected (or failed) this time
+        if record["digest"] is not None and cfg.output.digest(stale_path) == record["digest"]:
+            cfg.output.remove(stale_path)
+            image_dir_contents.discard(os.path.basename(stale_path))
+            print_success(f"{os.path.basename(stale_path)} removed from {os.path.dirname(stale_path)}")
+            cfg.metrics.count("images_removed")
+
+    if cfg.remove_deleted:
+        for f in image_dir_contents:
+            cfg.output.remove(f"{image_dir}/{f}")
+            print_success(f"{f} removed from {image_dir}")
+            cfg.metrics.count("images_removed")
+
+    # an incomplete manifest never lets --skip-unchanged skip the tour
+    cfg.state.record_images(tour_id, cfg.output.target, images_hash if complete else None, saved)
+    return complete
+
+def export_tour(cfg, tour_id, tour_base, process_images):
+    # returns False if the tour was not exported completely (failed images)
+    tour = make_gpx(cfg, tour_id, tour_base)
+    if cfg.analytics is not None:
+        with cfg.metrics.phase("analytics"):
+            add_tour_analytics(cfg, tour_id, tour_base, tour)
+    if process_images:
+        with cfg.metrics.phase("images"):
+            return download_tour_images(cfg, tour_id, tour_base)
+    return True
+
+def export_tours(cfg, tours, process_images, jobs):
+    # returns the ids of the tours that were not exported completely
+    try:
+        if jobs <= 1:
+            return [x for x in tours if not export_tour(cfg, x, tours[x], process_images)]
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(export_tour, cfg, x, tours[x], process_images) for x in tours]
+            try:
+                return [x for x, future in zip(tours, futures) if not future.result()]
+            except BaseException:
+                # don't start any further tours after the first failure (or Ctrl+C)
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        # keep the state of every tour written so far, even if the run is aborted
+        cfg.state.flush()
+
+def main(args, metrics=None):
+    from .api import API_URL, KomootApi, create_session
+    from .cache import PersistentCache
+    from .ratelimit import AdaptiveRateLimiter
+    from .output import open_output
+    from .recording import Recorder, ReplayArchive, record_session, replay_session
+    from .statestore import StateStore
+
+    if metrics is None:
+        metrics = Metrics()
+    migrate_credentials()
+    output = open_output(args.output, args.archive)
+    # an archive is completed however the run ends, with the tours written until then
+    atexit.register(output.close)
+    analytics = None
+    if args.analytics:
+        from .analytics import AnalyticsDataset
+        analytics = AnalyticsDataset(args.analytics)
+        atexit.register(analytics.close)
 
     process_images = args.add_images or args.all_images
 
@@ -346,6 +554,9 @@ def main(args):
         tour_selection = None
 
     tour_type_arg = f"tour_{args.tour_type}"
+    sync_key = None
+    changed_since = None
+    new_watermark = None
 
     filename_pattern = args.filename_pattern
     image_dir_pattern = os.path.splitext(filename_pattern)[0] + "_images"
@@ -357,149 +568,294 @@ def main(args):
         filename_pattern = "{id}.gpx"
         image_dir_pattern = "{id}_images"
 
+    if args.gzip:
+        filename_pattern += ".gz"
+
     if args.remove_deleted:
-        gpxpat = re.compile(r"\.gpx$")
-        for f in os.listdir(output_dir):
-            if os.path.isfile(os.path.join(output_dir, f)) and gpxpat.search(f):
+        gpxpat = re.compile(r"\.gpx\.gz$" if args.gzip else r"\.gpx$")
+        for f in output.listdir():
+            if gpxpat.search(f):
                 output_dir_contents.add(f)
 
-    api = KomootApi(debug=args.debug)
-
-    cfg = RunConfig(
-        api=api,
-        output_dir=output_dir,
-        filename_pattern=filename_pattern,
-        image_dir_pattern=image_dir_pattern,
-        no_poi=args.no_poi,
-        skip_existing=args.skip_existing,
-        skip_unchanged=args.skip_unchanged,
-        remove_deleted=args.remove_deleted,
-        max_title_length=args.max_title_length,
-        max_desc_length=args.max_desc_length,
-        all_images=args.all_images,
-        language=args.language,
-        karoo=args.karoo,
-    )
+    # every concurrent request (tours x highlights or images) needs its own pooled connection
+    concurrency = args.jobs * max(args.highlight_jobs, args.image_jobs if process_images else 1)
+    pool_size = max(args.pool_size, concurrency)
+    limiter = AdaptiveRateLimiter(args.max_rate, max_concurrency=pool_size, backoff=args.retry_backoff)
+    recorder = None
+    replay_archive = None
+    if args.replay:
+        replay_archive = ReplayArchive(args.replay)
+        session = replay_session(replay_archive)
+    else:
+        session = create_session(pool_size, args.retries, args.retry_backoff, limiter=limiter)
+    if args.record:
+        recorder = Recorder(args.record)
+        # the archive is closed however the run ends, a failed run is worth replaying too
+        atexit.register(recorder.close)
+        record_session(session, recorder)
+    # while recording or replaying every response has to go through the archive, so the
+    # persistent caches are bypassed and a replay starts from an empty sync state
+    use_caches = recorder is None and replay_archive is None
+    highlight_cache = None
+    if args.highlight_cache_ttl > 0 and use_caches:
+        highlight_cache = PersistentCache(cache_file(HIGHLIGHT_CACHEFILE_NAME), ttl=args.highlight_cache_ttl * 3600,
+                                          max_entries=args.highlight_cache_size)
+    # validators and bodies of tour and image responses, for conditional requests
+    response_cache = None
+    if args.http_cache_ttl > 0 and use_caches:
+        response_cache = PersistentCache(cache_file(RESPONSE_CACHEFILE_NAME), ttl=args.http_cache_ttl * 3600,
+                                         max_entries=None, max_bytes=int(args.http_cache_size * 1024 * 1024))
+    api = KomootApi(debug=args.debug, session=session, base_url=args.api_url or API_URL, cache=highlight_cache,
+                    http_cache=response_cache, metrics=metrics)
+    if replay_archive is not None:
+        state = StateStore(":memory:")
+    else:
+        state = StateStore(cache_file(STATEFILE_NAME), legacy_hashfile=cache_file(HASHFILE_NAME))
+    # queued tour records are written even when the run exits early (sys.exit() on API errors)
+    try:
+        # PNG conversion and EXIF tagging are CPU-bound, run them outside the GIL
+        image_pool = None
+        if process_images and args.image_jobs > 1:
+            from .imagedownload import PngConverterPool
+            image_pool = PngConverterPool(max_workers=min(args.image_jobs, os.cpu_count() or 1))
+
+        cfg = RunConfig(
+            api=api,
+            state=state,
+            output=output,
+            analytics=analytics,
+            filename_pattern=filename_pattern,
+            image_dir_pattern=image_dir_pattern,
+            no_poi=args.no_poi,
+            skip_existing=args.skip_existing,
+            skip_unchanged=args.skip_unchanged,
+            remove_deleted=args.remove_deleted,
+            max_title_length=args.max_title_length,
+            max_desc_length=args.max_desc_length,
+            all_images=args.all_images,
+            language=args.language,
+            karoo=args.karoo,
+            highlight_jobs=args.highlight_jobs,
+            simplify=args.simplify,
+            max_points=args.max_points,
+            image_jobs=args.image_jobs,
+            max_image_size=int(args.max_image_size * 1024 * 1024) if args.max_image_size is not None else None,
+            image_pool=image_pool,
+            metrics=metrics,
+        )
 
-    if args.debug:
-        resolved = {f.name: getattr(cfg, f.name) for f in fields(cfg) if f.name != "api"}
-        skip = set(resolved) | {"output", "poi", "alt_no_poi"}
-        resolved.update({name: value for name, value in vars(args).items() if name not in skip})
-
-        print_info("Effective settings (defaults < config file < command line):")
-        for name, value in sorted(resolved.items()):
-            if name == "password":
-                value = "***" if value else None  # never reveal the password
-            elif isinstance(value, bool):
-                value = boolToColorStr(value)
-            print(f"    {name:<18} = {value}")
-
-    mail = args.email
-    pwd = args.password
-
-    if not args.anonymous:
-        token = None
-        uid = None
-        display_name = None
-        if os.path.exists(CREDFILE):
-            with open(CREDFILE, "r", encoding="utf-8") as credfile:
-                creddata = json.load(credfile)
-                uid = creddata.get("user_id")
-                token = creddata.get("token")
-                date = creddata.get("date")
-                display_name = creddata.get("display_name", "(token user)")
-
-                if datetime.now().timestamp() - date > SESSION_TTL * 60:
-                    print("Stored credentials are outdated.")
-                    uid = None
-                    token = None
-                elif uid is None or token is None:
-                    print_error("Stored credentials are incomplete.")
-                    os.unlink(CREDFILE)
-                    sys.exit(1)
-
-        if uid and token:
-            print("Using stored credentials for user:", display_name)
-            api.login_with_token(uid, token, display_name)
-        else:
-            if mail is None:
-                notify_interactive()
-                mail = prompt("Enter your mail address (komoot login)")
-
-            if pwd is None:
-                notify_interactive()
-                pwd = prompt_pass("Enter your password (input hidden)")
-
-            api.login(mail, pwd)
-
-        with open(CREDFILE, "w", encoding="utf-8") as credfile:
-            creddata = {"user_id": api.user_id, "token": api.token, "display_name": api.display_name, "date": datetime.now().timestamp()}
-            json.dump(creddata, credfile)
-
-        if args.list_tours:
-            tours = api.fetch_tours(tour_type=tour_type_arg, silent=True)
-            list_tours(tours, args.start_date, args.end_date)
-            sys.exit(0)
-
-        have_full_tour_list = tour_selection == "all" or tour_selection is None
-        if have_full_tour_list:
-            tours = api.fetch_tours(tour_type_arg)
-            tours = date_filter(tours, args.start_date, args.end_date)
-            tours = private_public_filter(tours, args.private_only, args.public_only)
-            tours = sport_filter(tours, args.sport)
-
-            if args.recent is not None:
-                sorted_tours = sorted(tours.items(), key=lambda x: x[1].get('changed_at', ''), reverse=True)
-                tours = dict(sorted_tours[:args.recent])
-                print(f"Limited to {len(tours)} most recently changed tours")
-        else:
-            tours = {}
+        if args.debug:
+            resolved = {f.name: getattr(cfg, f.name) for f in fields(cfg) if f.name not in ("api", "state", "image_pool", "metrics")}
+            skip = set(resolved) | {"output", "poi", "alt_no_poi"}
+            resolved.update({name: value for name, value in vars(args).items() if name not in skip})
+
+            print_info("Effective settings (defaults < config file < command line):")
+            for name, value in sorted(resolved.items()):
+                if name == "password":
+                    value = "***" if value else None  # never reveal the password
+                elif isinstance(value, bool):
+                    value = boolToColorStr(value)
+                print(f"    {name:<18} = {value}")
+
+        mail = args.email
+        pwd = args.password
 
-    if tour_selection is None:
-        notify_interactive()
         if not args.anonymous:
-            tours = api.fetch_tours(tour_type=tour_type_arg, silent=True)
-            list_tours(tours, args.start_date, args.end_date)
-        tour_selection = prompt("Enter a tour id to download")
-
-    if not args.anonymous and tour_selection != "all" and have_full_tour_list and int(tour_selection) not in tours:
-        print_warning(f"Warning: This id ({tour_selection}) is not one of your tours. Use --list-tours to view complete list.")
-
-    if tour_selection == "all":
-        for x in tours:
-            make_gpx(cfg, x, tours[x])
-            if process_images and not args.anonymous:
-                download_tour_images(cfg, x, tours[x])
-    else:
-        if args.anonymous:
-            make_gpx(cfg, tour_selection, None)
-            if process_images:
-                print_warning(f"Warning: No image download in anonymous mode.")
+            token = None
+            uid = None
+            display_name = None
+            if replay_archive is not None:
+                if replay_archive.login is None:
+                    print_error(f"Archive '{args.replay}' holds no login, it was recorded in anonymous mode")
+                    sys.exit(2)
+                # requests are never sent, the token is not needed
+                uid = replay_archive.login["user_id"]
+                token = "replay"
+                display_name = replay_archive.login["display_name"]
+            elif os.path.exists(cache_file(CREDFILE_NAME)):
+                with open(cache_file(CREDFILE_NAME), "r", encoding="utf-8") as credfile:
+                    creddata = json.load(credfile)
+                    uid = creddata.get("user_id")
+                    token = creddata.get("token")
+                    date = creddata.get("date")
+                    display_name = creddata.get("display_name", "(token user)")
+
+                    if datetime.now().timestamp() - date > SESSION_TTL * 60:
+                        print("Stored credentials are outdated.")
+                        uid = None
+                        token = None
+                    elif uid is None or token is None:
+                        print_error("Stored credentials are incomplete.")
+                        os.unlink(cache_file(CREDFILE_NAME))
+                        sys.exit(1)
+
+            if uid and token:
+                print("Using " + ("recorded" if replay_archive is not None else "stored") + " credentials for user:", display_name)
+                with metrics.phase("login"):
+                    api.login_with_token(uid, token, display_name)
+            else:
+                if mail is None:
+                    notify_interactive()
+                    mail = prompt("Enter your mail address (komoot login)")
+
+                if pwd is None:
+                    notify_interactive()
+                    pwd = prompt_pass("Enter your password (input hidden)")
+
+                with metrics.phase("login"):
+                    api.login(mail, pwd)
+
+            if replay_archive is None:
+                with open(cache_file(CREDFILE_NAME), "w", encoding="utf-8") as credfile:
+                    creddata = {"user_id": api.user_id, "token": api.token, "display_name": api.display_name, "date": datetime.now().timestamp()}
+                    json.dump(creddata, credfile)
+            if recorder is not None:
+                recorder.record_login(api.user_id, api.display_name)
+
+            if args.list_tours:
+                tours = api.fetch_tours(tour_type=tour_type_arg, silent=True)
+                list_tours(tours, args.start_date, args.end_date)
+                sys.exit(0)
+
+            have_full_tour_list = tour_selection == "all" or tour_selection is None
+            if have_full_tour_list:
+                if args.incremental:
+                    sync_key = watermark_key(api.user_id, args)
+                    watermark = state.get_meta(sync_key)
+                    if watermark is not None:
+                        print(f"Incremental sync, looking for tours changed after {watermark}")
+                        changed_since = parse_date_str(watermark)
+
+                with metrics.phase("list"):
+                    tours = api.fetch_tours(tour_type_arg, changed_since=changed_since)
+                if args.incremental and tours:
+                    new_watermark = max((tour['changed_at'] for tour in tours.values()), key=parse_date_str)
+                tours = date_filter(tours, args.start_date, args.end_date)
+                tours = private_public_filter(tours, args.private_only, args.public_only)
+                tours = sport_filter(tours, args.sport)
+
+                if args.recent is not None:
+                    sorted_tours = sorted(tours.items(), key=lambda x: x[1].get('changed_at', ''), reverse=True)
+                    tours = dict(sorted_tours[:args.recent])
+                    print(f"Limited to {len(tours)} most recently changed tours")
+            else:
+                tours = {}
+
+        if tour_selection is None:
+            notify_interactive()
+            if not args.anonymous:
+                tours = api.fetch_tours(tour_type=tour_type_arg, silent=True)
+                list_tours(tours, args.start_date, args.end_date)
+            tour_selection = prompt("Enter a tour id to download")
+
+        if not args.anonymous and tour_selection != "all" and have_full_tour_list and int(tour_selection) not in tours:
+            print_warning(f"Warning: This id ({tour_selection}) is not one of your tours. Use --list-tours to view complete list.")
+
+        if tour_selection == "all":
+            incomplete = export_tours(cfg, tours, process_images and not args.anonymous, args.jobs)
+
+            if new_watermark is not None and incomplete:
+                # tours with failed images must be listed again by the next run, the watermark stays below them
+                oldest = min(parse_date_str(tours[x]['changed_at']) for x in incomplete)
+                earlier = [tour['changed_at'] for tour in tours.values() if parse_date_str(tour['changed_at']) < oldest]
+                new_watermark = max(earlier, key=parse_date_str) if earlier else None
+                print_warning(f"{len(incomplete)} tours were not exported completely, they are retried by the next incremental run")
+
+            # only advance the watermark once every listed tour has been handled
+            if new_watermark is not None and (changed_since is None or parse_date_str(new_watermark) > changed_since):
+                state.set_meta(sync_key, new_watermark)
         else:
-            if int(tour_selection) in tours:
-                make_gpx(cfg, tour_selection, tours[int(tour_selection)])
+            if args.anonymous:
+                export_tour(cfg, tour_selection, None, False)
                 if process_images:
-                    download_tour_images(cfg, tour_selection, tours[int(tour_selection)])
+                    print_warning(f"Warning: No image download in anonymous mode.")
             else:
-                make_gpx(cfg, tour_selection, None)
-                if process_images:
-                    download_tour_images(cfg, tour_selection, None)
+                if int(tour_selection) in tours:
+                    export_tour(cfg, tour_selection, tours[int(tour_selection)], process_images)
+                else:
+                    export_tour(cfg, tour_selection, None, process_images)
+
+        if args.remove_deleted:
+            for f in output_dir_contents:
+                output.remove(output.path(f))
+                print_success(f"{f} removed from {output}")
+            if analytics is not None:
+                analytics.retain(tours)
+
+        output.close()
+        if analytics is not None:
+            analytics.close()
+            print_info(f"Analytics dataset '{args.analytics}': {analytics.written} tours added or updated, {analytics.removed} removed")
+    finally:
+        state.close()
+    if image_pool is not None:
+        image_pool.shutdown()
+    if recorder is not None:
+        recorder.close()
+        print_info(f"Recorded {recorder.count} responses to {args.record}")
+    if replay_archive is not None:
+        print_info(f"Replayed {replay_archive.served} responses from {args.replay}, {replay_archive.missed} requests were not recorded")
 
-    if args.remove_deleted:
-        for f in output_dir_contents:
-            os.unlink(os.path.join(output_dir, f))
-            print_success(f"{f} removed from {output_dir}")
+    if args.debug:
+        print_info(f"Highlight lookups: {api.memo_stats_str()}")
+    metrics.record_cache("highlight_memo", api.memo_hits, api.memo_misses)
+    metrics.count("requests_throttled", limiter.throttled)
+    if highlight_cache is not None:
+        if args.debug:
+            print_info(f"Highlight cache: {highlight_cache.stats_str()}")
+        metrics.record_cache("highlights", highlight_cache.hits, highlight_cache.misses)
+        highlight_cache.close()
+    if response_cache is not None:
+        metrics.record_cache("responses", response_cache.hits, response_cache.misses)
+        if args.debug:
+            print_info(f"Response cache: {response_cache.stats_str()}")
+        response_cache.close()
 
 def entrypoint():
+    from colorama import init as colorama_init
+    colorama_init()
+
+    # answered before the argument parser (and config file handling) is even loaded
+    if sys.argv[1:] in (["-v"], ["--version"]):
+        print(f"komootgpx {__version__}")
+        sys.exit(0)
+    if sys.argv[1:] in (["-h"], ["--help"]):
+        usage()
+        sys.exit(0)
+
     args = parse_args()
+    metrics = Metrics()
+    status = "error"
     try:
-        return main(args)
+        result = main(args, metrics)
+        status = "ok"
+        return result
+    except SystemExit as e:
+        if e.code in (None, 0):
+            status = "ok"
+        raise
     except KeyboardInterrupt as e:
+        status = "aborted"
         print()
         print_error(f"Aborted by user: {e}")
         sys.exit(1)
+    finally:
+        emit_metrics(args, metrics, status)
+
+def emit_metrics(args, metrics, status):
+    if args.stats:
+        print_info(f"Run statistics ({status}):")
+        for line in metrics.summary_lines():
+            print(line)
+    if args.metrics_file:
+        metrics.write(args.metrics_file, status)
 
 def parse_args():
+    import argparse
+    import importlib.util
+    import configargparse
+    from .output import archive_kind
+
     parser = configargparse.ArgParser(
         description="Download Komoot tours and highlights as GPX files.",
         default_config_files=[CONFIGFILE],
@@ -522,12 +878,14 @@ def parse_args():
     # entry "skip-existing: false" is silently turned into True. Long-first lets
     # it emit "--no-skip-existing" and honour the false value.
     parser.add_argument("--skip-existing", "-s", action=argparse.BooleanOptionalAction, default=False, help="Skip already downloaded tours")
-    parser.add_argument("--skip-unchanged", "-S", action=argparse.BooleanOptionalAction, default=False, help="Skip tours that have not changed since last download (uses hash verification)")
-    parser.add_argument("--remove-deleted", "-r", action=argparse.BooleanOptionalAction, default=False, help="Remove gpx files for nonexistent tours")
+    parser.add_argument("--skip-unchanged", "-S", action=argparse.BooleanOptionalAction, default=False, help="Skip tours and images that have not changed since last download (uses hash verification)")
+    parser.add_argument("--incremental", action=argparse.BooleanOptionalAction, default=False, help="Only fetch tours changed since the last successful run")
+    parser.add_argument("--remove-deleted", "-r", action=argparse.BooleanOptionalAction, default=False, help="Remove gpx files and images for nonexistent tours and images")
     parser.add_argument("-f", "--filename-pattern", type=str, default="{title}-{id}.gpx", help="Filename pattern")
     parser.add_argument("-I", "--id-filename", action="store_true", help="Use tour ID as filename")
     parser.add_argument("-D", "--add-date", action="store_true", help="Prepend filename with tour modification date")
     parser.add_argument("--max-title-length", type=int, default=-1, help="Maximum length for titles")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Export up to N tours concurrently")
     parser.add_argument("-L", "--language", type=str, default="en", help="Select description language (default=en)")
 
     parser.add_argument("-t", "--tour-type", choices=["planned", "recorded", "all"], default="all", help="Tour type to filter")
@@ -538,18 +896,42 @@ def parse_args():
     parser.add_argument("--public-only", action="store_true", help="Include only public tours")
 
     parser.add_argument("-o", "--output", type=str, default=os.getcwd(), help="Output directory")
+    parser.add_argument("--gzip", action="store_true", default=False, help="Write gzip compressed .gpx.gz files")
+    parser.add_argument("--archive", type=str, default=None, help="Write all tours and images into this .zip, .tar or .tar.gz archive")
+    parser.add_argument("--analytics", type=str, default=None, help="Also export route points and tour metadata as Parquet files to this directory")
     # --poi / -e keep default=None to resolve no_poi later
     parser.add_argument("--poi", action=argparse.BooleanOptionalAction, default=None, help="Include POIs in GPX")
     parser.add_argument("-e", "--alt-no-poi", action="store_true", default=None, help="Do not include POIs in GPX")
     parser.add_argument("--karoo", "-K", action=argparse.BooleanOptionalAction, default=False, help="Save all POIs with Generic type (Hammerhead Karoo import compatibility)")
     parser.add_argument("--max-desc-length", type=int, default=-1, help="Maximum length for descriptions")
+    parser.add_argument("--simplify", type=float, default=None, help="Simplify the track with the given tolerance in meters")
+    parser.add_argument("--max-points", type=int, default=None, help="Simplify the track to at most N points")
+    parser.add_argument("--highlight-jobs", type=int, default=4, help="Fetch up to N highlight tips of a tour concurrently")
+    parser.add_argument("--highlight-cache-ttl", type=float, default=168, help="Reuse cached highlights for N hours (0 disables the cache)")
+    parser.add_argument("--highlight-cache-size", type=int, default=10000, help="Maximum number of cached highlight entries")
 
     parser.add_argument("--add-images", "-i", action=argparse.BooleanOptionalAction, default=False, help="Add tour images")
     parser.add_argument("--all-images", action=argparse.BooleanOptionalAction, default=False, help="Download images from other users too - please review the copyright")
+    parser.add_argument("--max-image-size", type=float, default=None, help="Skip images larger than N megabytes")
+    parser.add_argument("--image-jobs", type=int, default=4, help="Download and process up to N images of a tour concurrently")
+
+    parser.add_argument("--api-url", type=str, default=None, help="Base URL of the Komoot API (default: https://api.komoot.de)")
+    parser.add_argument("--pool-size", type=int, default=10, help="Maximum number of pooled keep-alive connections")
+    parser.add_argument("--retries", type=int, default=3, help="Retry failed requests up to N times")
+    parser.add_argument("--max-rate", type=float, default=None, help="Send at most N requests per second")
+    parser.add_argument("--retry-backoff", type=float, default=0.5, help="Exponential backoff factor between retries in seconds")
+
+    parser.add_argument("--http-cache-ttl", type=float, default=720, help="Revalidate cached tours and images for N hours (0 disables conditional requests)")
+    parser.add_argument("--http-cache-size", type=float, default=100, help="Maximum size of the cached responses in megabytes")
 
     parser.add_argument("--debug", action="store_true", default=False, help="Debug")
+    parser.add_argument("--record", type=str, default=None, help="Record all API requests and responses to this archive")
+    parser.add_argument("--replay", type=str, default=None, help="Serve all API requests from this archive")
+
+    parser.add_argument("--stats", action="store_true", default=False, help="Print run statistics at exit")
+    parser.add_argument("--metrics-file", type=str, default=None, help="Write run statistics as JSON to this file at exit")
 
-    parser.add_argument("--clear-cache", action="store_true", help="Clear cached credentials and file hashes")
+    parser.add_argument("--clear-cache", action="store_true", help="Clear cached credentials, file hashes and highlights")
     parser.add_argument("-h", "--help", action="store_true", help="Prints help")
     parser.add_argument("-v", "--version", action="store_true", help="Prints version")
 
@@ -564,7 +946,8 @@ def parse_args():
         sys.exit(0)
 
     if args.clear_cache:
-        for f in (CREDFILE, HASHFILE):
+        for name in (CREDFILE_NAME, STATEFILE_NAME, STATEFILE_NAME + "-wal", STATEFILE_NAME + "-shm", HIGHLIGHT_CACHEFILE_NAME, RESPONSE_CACHEFILE_NAME, HASHFILE_NAME):
+            f = cache_file(name)
             if os.path.isfile(f):
                 os.unlink(f)
                 print_success(f"Removed {f}")
@@ -604,6 +987,71 @@ def parse_args():
         print_error("--remove-deleted works only with --make-all")
         sys.exit(2)
 
+    if args.incremental and not args.make_all:
+        print_error("--incremental works only with --make-all")
+        sys.exit(2)
+
+    if args.incremental and args.remove_deleted:
+        # an incremental listing does not contain unchanged tours, their files would be removed
+        print_error("Cannot specify both --incremental and --remove-deleted")
+        sys.exit(2)
+
+    if args.simplify is not None and args.simplify < 0:
+        print_error("--simplify must not be negative")
+        sys.exit(2)
+
+    if args.max_points is not None and args.max_points < 2:
+        print_error("--max-points must be at least 2")
+        sys.exit(2)
+
+    if args.jobs < 1 or args.highlight_jobs < 1 or args.image_jobs < 1:
+        print_error("--jobs, --highlight-jobs and --image-jobs must be at least 1")
+        sys.exit(2)
+
+    if args.highlight_cache_ttl < 0 or args.highlight_cache_size < 1:
+        print_error("--highlight-cache-ttl must not be negative and --highlight-cache-size must be at least 1")
+        sys.exit(2)
+
+    if args.max_image_size is not None and args.max_image_size <= 0:
+        print_error("--max-image-size must be positive")
+        sys.exit(2)
+
+    if args.http_cache_ttl < 0 or args.http_cache_size <= 0:
+        print_error("--http-cache-ttl must not be negative and --http-cache-size must be positive")
+        sys.exit(2)
+
+    if args.pool_size < 1:
+        print_error("--pool-size must be at least 1")
+        sys.exit(2)
+
+    if args.max_rate is not None and args.max_rate <= 0:
+        print_error("--max-rate must be positive")
+        sys.exit(2)
+
+    if args.retries < 0 or args.retry_backoff < 0:
+        print_error("--retries and --retry-backoff must not be negative")
+        sys.exit(2)
+
+    if args.archive is not None and archive_kind(args.archive) is None:
+        print_error("--archive must end with .zip, .tar, .tar.gz or .tgz")
+        sys.exit(2)
+
+    if args.archive is not None and args.gzip:
+        print_error("Cannot specify both --archive and --gzip")
+        sys.exit(2)
+
+    if args.analytics is not None and importlib.util.find_spec("pyarrow") is None:
+        print_error("--analytics requires pyarrow, install it with: pip install 'komootgpx[analytics]'")
+        sys.exit(2)
+
+    if args.record and args.replay:
+        print_error("Cannot specify both --record and --replay")
+        sys.exit(2)
+
+    if args.replay and not os.path.isfile(args.replay):
+        print_error(f"Archive '{args.replay}' does not exist")
+        sys.exit(2)
+
     # Parse date ranges
     start_date = None
     end_date = None
@@ -0,0 +1,104 @@
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+def endpoint_of(url):
+    # groups API requests by endpoint, e.g. /v007/tours/123/cover_images/ -> /v007/tours/{id}/cover_images/
+    path = urlparse(url).path
+    path = re.sub(r"^/v006/account/email/[^/]+/", "/v006/account/email/{email}/", path)
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path)
+
+
+class Metrics:
+    # Telemetry of a single run: wall time per phase, request statistics per endpoint and counters.
+    # Phase times are summed over all worker threads, so with --jobs they can exceed the total wall time.
+    # Safe to share between threads.
+
+    def __init__(self):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._requests = {}
+        self._counters = {}
+        self._caches = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._phases[name] = self._phases.get(name, 0.0) + elapsed
+
+    def record_request(self, endpoint, status, seconds, size):
+        with self._lock:
+            stats = self._requests.get(endpoint)
+            if stats is None:
+                stats = self._requests[endpoint] = {"count": 0, "bytes": 0, "seconds": 0.0, "status": {},
+                                                    "latency_histogram": [0] * len(LATENCY_BUCKETS)}
+            stats["count"] += 1
+            stats["bytes"] += size
+            stats["seconds"] += seconds
+            stats["status"][str(status)] = stats["status"].get(str(status), 0) + 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats["latency_histogram"][i] += 1
+                    break
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def record_cache(self, name, hits, misses):
+        with self._lock:
+            self._caches[name] = {"hits": hits, "misses": misses,
+                                  "hit_ratio": hits / (hits + misses) if hits + misses else None}
+
+    def to_dict(self, status="ok"):
+        with self._lock:
+            requests = {endpoint: dict(stats, status=dict(stats["status"]),
+                                       latency_histogram=dict(zip(
+                                           ("+Inf" if b == float("inf") else str(b) for b in LATENCY_BUCKETS),
+                                           stats["latency_histogram"])))
+                        for endpoint, stats in self._requests.items()}
+            return {
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started)),
+                "status": status,
+                "wall_seconds": time.perf_counter() - self._start,
+                "phases": dict(self._phases),
+                "requests": requests,
+                "request_count": sum(stats["count"] for stats in requests.values()),
+                "bytes_downloaded": sum(stats["bytes"] for stats in requests.values()),
+                "caches": dict(self._caches),
+                "counters": dict(self._counters),
+            }
+
+    def write(self, path, status="ok"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(status), f, indent=2)
+
+    def summary_lines(self):
+        data = self.to_dict()
+        lines = [f"Wall time {data['wall_seconds']:.2f}s, {data['request_count']} requests, "
+                 f"{data['bytes_downloaded'] / 1024:.1f} KiB downloaded"]
+        for name, seconds in data["phases"].items():
+            lines.append(f"    phase {name:<10} {seconds:8.2f}s")
+        for endpoint, stats in sorted(data["requests"].items()):
+            lines.append(f"    {endpoint:<40} {stats['count']:>6} requests, "
+                         f"avg {stats['seconds'] / stats['count'] * 1000:.0f}ms, {stats['bytes'] / 1024:.1f} KiB")
+        for name, stats in data["caches"].items():
+            ratio = f"{100.0 * stats['hit_ratio']:.1f}%" if stats["hit_ratio"] is not None else "n/a"
+            lines.append(f"    cache {name:<18} {stats['hits']} hits, {stats['misses']} misses ({ratio})")
+        for name, value in sorted(data["counters"].items()):
+            lines.append(f"    {name:<24} {value}")
+        return lines
@@ -0,0 +1,350 @@
+import codecs
+import gzip
+import hashlib
+import io
+import itertools
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+from .utils import file_digest
+
+# members of an archive are addressed as "<archive path>/<name>", like files of a directory
+ARCHIVE_SUFFIXES = {".zip": "zip", ".tar": "tar", ".tar.gz": "tar.gz", ".tgz": "tar.gz"}
+
+
+def archive_kind(path):
+    # "zip", "tar", "tar.gz" or None
+    lower = path.lower()
+    for suffix, kind in ARCHIVE_SUFFIXES.items():
+        if lower.endswith(suffix):
+            return kind
+    return None
+
+
+class DirectoryOutput:
+    # Tours and images as files below a directory. Tour files whose name ends with .gz are gzip compressed.
+
+    def __init__(self, root):
+        self.root = root
+        # identifies the output in the sync state
+        self.target = os.path.abspath(root)
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def __str__(self):
+        return self.root
+
+    def path(self, name):
+        return f"{self.root}/{name}"
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isfile(self, path):
+        return os.path.isfile(path)
+
+    def size(self, path):
+        return os.path.getsize(path)
+
+    def digest(self, path):
+        return file_digest(path)
+
+    def listdir(self, path=None):
+        # names of the files in a directory (default: the root), empty if it does not exist
+        path = self.root if path is None else path
+        if not os.path.isdir(path):
+            return []
+        return [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
+
+    def remove(self, path):
+        os.unlink(path)
+
+    @contextmanager
+    def write_text(self, path, mtime):
+        # text file written in place, its mtime/atime set to mtime
+        if path.endswith(".gz"):
+            # the gzip header stores mtime too, so unchanged tours compress to the same bytes
+            with open(path, "wb") as raw, \
+                    gzip.GzipFile(filename=os.path.basename(path)[:-3], mode="wb", fileobj=raw, mtime=int(mtime)) as gz, \
+                    io.TextIOWrapper(gz, encoding="utf-8") as f:
+                yield f
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                yield f
+        os.utime(path, (mtime, mtime))
+
+    def staging_path(self, path):
+        # where a file is written before commit(), for a directory the file itself
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def commit(self, path, staged, mtime):
+        pass
+
+    def close(self):
+        pass
+
+
+class ArchiveOutput:
+    # Tours and images as members of a single zip or tar (.tar, .tar.gz) archive.
+    # Every run streams the members it writes into a staging archive beside the old one. On close(),
+    # if members were only added, they are appended to a zip or .tar archive. Otherwise (members
+    # replaced or removed, or any change to a .tar.gz) the members of the old archive that were
+    # neither rewritten nor removed are copied over and the new archive replaces the old one.
+    # Safe to share between threads.
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.target = os.path.abspath(archive)
+        self.kind = archive_kind(archive)
+        self._lock = threading.Lock()
+        self._written = {}
+        self._removed = set()
+        self._counter = itertools.count()
+        self._closed = False
+
+        directory = os.path.dirname(archive)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # an append interrupted by a crash in a previous run
+        _rollback(archive)
+
+        # name -> size of the members of the previous archive
+        self._existing = {}
+        # name -> data offset of the members of a .tar, for digest()
+        self._offsets = {}
+        # name -> digest of the members of a .tar.gz, filled in one pass by the first digest()
+        self._digests = None
+        if os.path.isfile(archive):
+            if self.kind == "zip":
+                with zipfile.ZipFile(archive) as zf:
+                    self._existing = {info.filename: info.file_size for info in zf.infolist() if not info.is_dir()}
+            else:
+                # only a .tar.gz has to be decompressed for this, a .tar is listed by seeking from header to header
+                with tarfile.open(archive, "r:*") as tf:
+                    for member in tf:
+                        if member.isfile():
+                            self._existing[member.name] = member.size
+                            self._offsets[member.name] = member.offset_data
+
+        self._staging = tempfile.mkdtemp(prefix=".komootgpx-", dir=directory or ".")
+        self._tmp = os.path.join(self._staging, "archive.part")
+        if self.kind == "zip":
+            self._writer = zipfile.ZipFile(self._tmp, "w", zipfile.ZIP_DEFLATED)
+        else:
+            self._writer = tarfile.open(self._tmp, "w:gz" if self.kind == "tar.gz" else "w")
+
+    def __str__(self):
+        return self.archive
+
+    def path(self, name):
+        return f"{self.archive}/{name}"
+
+    def _member(self, path):
+        prefix = self.archive + "/"
+        return path[len(prefix):] if path.startswith(prefix) else None
+
+    def exists(self, path):
+        return self.isfile(path)
+
+    def isfile(self, path):
+        member = self._member(path)
+        with self._lock:
+            return member in self._written or (member in self._existing and member not in self._removed)
+
+    def size(self, path):
+        member = self._member(path)
+        with self._lock:
+            if member in self._written:
+                return self._written[member]
+            return self._existing[member]
+
+    def digest(self, path):
+        # members of the previous archive only, new members are hashed while they are written
+        member = self._member(path)
+        if self.kind == "zip":
+            with zipfile.ZipFile(self.archive) as zf, zf.open(member) as f:
+                return _sha256(f, self._existing[member])
+        if self.kind == "tar":
+            with open(self.archive, "rb") as f:
+                f.seek(self._offsets[member])
+                return _sha256(f, self._existing[member])
+        # a compressed tar can only be read sequentially, so all members are hashed in a single pass
+        with self._lock:
+            if self._digests is None:
+                with tarfile.open(self.archive, "r:*") as tf:
+                    self._digests = {m.name: _sha256(tf.extractfile(m), m.size) for m in tf if m.isfile()}
+            return self._digests[member]
+
+    def listdir(self, path=None):
+        prefix = "" if path is None else self._member(path) + "/"
+        with self._lock:
+            names = set(self._written) | (set(self._existing) - self._removed)
+        return [name[len(prefix):] for name in names if name.startswith(prefix) and "/" not in name[len(prefix):]]
+
+    def remove(self, path):
+        with self._lock:
+            self._removed.add(self._member(path))
+
+    @contextmanager
+    def write_text(self, path, mtime):
+        # buffered (in memory up to 8 MB) and added as a whole, so concurrent tours don't interleave
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024, dir=self._staging) as buffer:
+            yield codecs.getwriter("utf-8")(buffer)
+            size = buffer.tell()
+            buffer.seek(0)
+            self._add(self._member(path), buffer, size, mtime, compress=True)
+
+    def staging_path(self, path):
+        return os.path.join(self._staging, f"{next(self._counter)}-{os.path.basename(path)}")
+
+    def commit(self, path, staged, mtime):
+        # moves a file written to staging_path() into the archive
+        try:
+            with open(staged, "rb") as f:
+                # images are compressed already
+                self._add(self._member(path), f, os.path.getsize(staged), mtime, compress=False)
+        finally:
+            os.unlink(staged)
+
+    def _add(self, member, f, size, mtime, compress):
+        with self._lock:
+            if self.kind == "zip":
+                # zip timestamps are local time, starting in 1980
+                info = zipfile.ZipInfo(member, date_time=time.localtime(max(mtime, 315532800))[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+                info.external_attr = 0o644 << 16
+                with self._writer.open(info, "w") as dst:
+                    shutil.copyfileobj(f, dst, 1024 * 1024)
+            else:
+                info = tarfile.TarInfo(member)
+                info.size = size
+                info.mtime = int(mtime)
+                info.mode = 0o644
+                self._writer.addfile(info, f)
+            self._written[member] = size
+
+    def close(self):
+        # finishes the archive, unless nothing changed at all
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            try:
+                keep = set(self._existing) - set(self._written) - self._removed
+                if len(keep) == len(self._existing) and self._existing and self.kind != "tar.gz":
+                    self._writer.close()
+                    if self._written:
+                        self._append_members()
+                elif self._written or len(keep) != len(self._existing):
+                    self._copy_members(keep)
+                    self._writer.close()
+                    os.replace(self._tmp, self.archive)
+                else:
+                    self._writer.close()
+            finally:
+                shutil.rmtree(self._staging, ignore_errors=True)
+
+    def _append_members(self):
+        # only new members: they are appended to the old archive instead of copying all of it.
+        # The append overwrites the end of the archive (the zip central directory, the tar end blocks),
+        # which is saved to a journal first, so a failed or interrupted append is rolled back
+        try:
+            if self.kind == "zip":
+                with zipfile.ZipFile(self._tmp) as new, zipfile.ZipFile(self.archive, "a") as old:
+                    _write_journal(self.archive, old.start_dir)
+                    for info in new.infolist():
+                        _copy_zip_member(new, info, old)
+            else:
+                with tarfile.open(self._tmp) as new, tarfile.open(self.archive, "a") as old:
+                    _write_journal(self.archive, old.offset)
+                    for member in new:
+                        old.addfile(member, new.extractfile(member))
+            with open(self.archive, "rb+") as f:
+                os.fsync(f.fileno())
+        except BaseException:
+            _rollback(self.archive)
+            raise
+        os.unlink(_journal(self.archive))
+
+    def _copy_members(self, keep):
+        if not keep:
+            return
+        if self.kind == "zip":
+            with zipfile.ZipFile(self.archive) as old:
+                for info in old.infolist():
+                    if info.filename in keep:
+                        _copy_zip_member(old, info, self._writer)
+        else:
+            # sequential, so a compressed tar is only decompressed once
+            with tarfile.open(self.archive, "r:*") as old:
+                for member in old:
+                    if member.name in keep:
+                        self._writer.addfile(member, old.extractfile(member))
+
+
+def _journal(archive):
+    return archive + ".journal"
+
+
+def _write_journal(archive, offset):
+    # size of the archive, offset and the bytes from offset to its end
+    with open(archive, "rb") as f:
+        f.seek(offset)
+        tail = f.read()
+    tmp = _journal(archive) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write((offset + len(tail)).to_bytes(8, "little"))
+        f.write(offset.to_bytes(8, "little"))
+        f.write(tail)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, _journal(archive))
+
+
+def _rollback(archive):
+    # restores the archive as it was before an append, if there is a journal of it
+    try:
+        with open(_journal(archive), "rb") as f:
+            size = int.from_bytes(f.read(8), "little")
+            offset = int.from_bytes(f.read(8), "little")
+            tail = f.read()
+    except FileNotFoundError:
+        return
+    with open(archive, "rb+") as f:
+        f.seek(offset)
+        f.write(tail)
+        f.truncate(size)
+        f.flush()
+        os.fsync(f.fileno())
+    os.unlink(_journal(archive))
+
+
+def _copy_zip_member(src_zip, info, dst_zip):
+    copy = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    copy.compress_type = info.compress_type
+    copy.external_attr = info.external_attr
+    with src_zip.open(info) as src, dst_zip.open(copy, "w") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def _sha256(f, size):
+    sha = hashlib.sha256()
+    while size > 0:
+        chunk = f.read(min(size, 1024 * 1024))
+        if not chunk:
+            break
+        sha.update(chunk)
+        size -= len(chunk)
+    return sha.hexdigest()
+
+
+def open_output(output_dir, archive=None):
+    return ArchiveOutput(archive) if archive else DirectoryOutput(output_dir)
@@ -0,0 +1,115 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from requests.adapters import HTTPAdapter
+
+# responses telling the client to slow down
+THROTTLE_STATUS = (429, 503)
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date; returns seconds or None
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    # Client-side limiter shared by every request of a run (tours, highlights and images).
+    # A token bucket caps the request rate, the number of concurrent requests follows AIMD:
+    # every healthy response widens the window additively, a throttling response (429/503)
+    # halves it and pauses all requests for Retry-After seconds (or an exponential backoff).
+    # Safe to share between threads.
+
+    MAX_DELAY = 60.0
+
+    def __init__(self, max_rate=None, max_concurrency=10, backoff=0.5):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.backoff = backoff
+        self.in_flight = 0
+        self.throttled = 0
+        self._tokens = 1.0
+        self._refilled = time.monotonic()
+        self._blocked_until = 0.0
+        self._next_decrease = 0.0
+        self._consecutive = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    self._cond.wait(self._blocked_until - now)
+                    continue
+                if self.in_flight >= int(self.limit):
+                    self._cond.wait()
+                    continue
+                if self.rate is not None:
+                    # bursts of up to one second worth of requests
+                    self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._refilled) * self.rate)
+                    self._refilled = now
+                    if self._tokens < 1.0:
+                        self._cond.wait((1.0 - self._tokens) / self.rate)
+                        continue
+                    self._tokens -= 1.0
+                self.in_flight += 1
+                return
+
+    def release(self, throttled=False, retry_after=None):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttled += 1
+                self._consecutive += 1
+                # responses of requests sent before the pause count as a single throttling episode
+                if now >= self._next_decrease:
+                    self.limit = max(1.0, self.limit / 2)
+                    if self.rate is not None:
+                        self.rate = max(0.1, self.rate / 2)
+                if retry_after is None:
+                    retry_after = min(self.MAX_DELAY, self.backoff * 2 ** (self._consecutive - 1))
+                self._blocked_until = max(self._blocked_until, now + min(retry_after, self.MAX_DELAY))
+                self._next_decrease = self._blocked_until
+            else:
+                self._consecutive = 0
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+                if self.rate is not None:
+                    self.rate = min(self.max_rate, self.rate + 1.0 / max(1.0, self.rate))
+            self._cond.notify_all()
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    # Sends every request through the limiter and repeats throttled requests once it allows
+    def __init__(self, limiter, throttle_retries=3, **kwargs):
+        self.limiter = limiter
+        self.throttle_retries = throttle_retries
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                resp = super().send(request, **kwargs)
+            except BaseException:
+                self.limiter.release()
+                raise
+
+            throttled = resp.status_code in THROTTLE_STATUS
+            self.limiter.release(throttled, parse_retry_after(resp.headers.get("Retry-After")) if throttled else None)
+            if not throttled or attempt >= self.throttle_retries:
+                return resp
+            resp.close()
+            attempt += 1
@@ -0,0 +1,174 @@
+import base64
+import gzip
+import io
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.response import HTTPResponse
+
+from .__version__ import __version__
+from .fastjson import dumps, loads
+from .utils import print_warning
+
+# never written to an archive
+PRIVATE_HEADERS = ("authorization", "cookie", "set-cookie")
+# describe the encoding on the wire, the archive holds the decoded body
+TRANSFER_HEADERS = ("content-encoding", "transfer-encoding", "content-length")
+
+
+def is_login_url(url):
+    # login responses carry the API token, they are left out of archives
+    return "/account/" in urlparse(url).path
+
+
+class Recorder:
+    # Writes request/response pairs to a gzip compressed JSON lines archive, one object per line:
+    # an "archive" header, "login" with the user of the run and one "exchange" per response.
+    # Safe to share between threads.
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._write({"type": "archive", "komootgpx": __version__,
+                     "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())})
+
+    def _write(self, entry):
+        line = dumps(entry) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+
+    def record_login(self, user_id, display_name):
+        self._write({"type": "login", "user_id": user_id, "display_name": display_name})
+
+    def record(self, request, response, elapsed):
+        body = response.content
+        entry = {
+            "type": "exchange",
+            "method": request.method,
+            "url": request.url,
+            "request_headers": {k: v for k, v in request.headers.items() if k.lower() not in PRIVATE_HEADERS},
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {k: v for k, v in response.headers.items()
+                        if k.lower() not in PRIVATE_HEADERS and k.lower() not in TRANSFER_HEADERS},
+            "elapsed": elapsed,
+        }
+        content_type = response.headers.get("Content-Type", "")
+        if "json" in content_type or content_type.startswith("text/"):
+            try:
+                entry["body"] = body.decode("utf-8")
+            except UnicodeDecodeError:
+                pass
+        if "body" not in entry:
+            entry["body_base64"] = base64.b64encode(body).decode("ascii")
+        self._write(entry)
+        with self._lock:
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RecordingAdapter(BaseAdapter):
+    # Passes requests on to another adapter and records every response it returns
+    def __init__(self, adapter, recorder):
+        super().__init__()
+        self.adapter = adapter
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        resp = self.adapter.send(request, **kwargs)
+        if not is_login_url(request.url):
+            # reads the whole body, later iter_content() calls are served from memory
+            self.recorder.record(request, resp, time.perf_counter() - start)
+        return resp
+
+    def close(self):
+        self.adapter.close()
+
+
+def record_session(session, recorder):
+    # records everything sent through the adapters mounted on session
+    for prefix, adapter in list(session.adapters.items()):
+        session.mount(prefix, RecordingAdapter(adapter, recorder))
+    return session
+
+
+class ReplayArchive:
+    # Responses of an archive written by Recorder, by method and URL. Repeated requests of
+    # the same URL get the recorded responses in order, the last one is served from then on.
+
+    def __init__(self, path):
+        self.path = path
+        self.login = None
+        self.served = 0
+        self.missed = 0
+        self._responses = {}
+        self._lock = threading.Lock()
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    entry = loads(line)
+                    if entry["type"] == "login":
+                        self.login = entry
+                    elif entry["type"] == "exchange":
+                        self._responses.setdefault((entry["method"], entry["url"]), deque()).append(entry)
+            except EOFError:
+                # the recording run was killed before the archive was closed
+                print_warning(f"Archive '{path}' is truncated, replaying the responses recorded up to there")
+
+    def next(self, method, url):
+        with self._lock:
+            entries = self._responses.get((method, url))
+            if not entries:
+                self.missed += 1
+                return None
+            self.served += 1
+            return entries.popleft() if len(entries) > 1 else entries[0]
+
+
+class ReplayAdapter(HTTPAdapter):
+    # Serves requests from a ReplayArchive without touching the network. Requests missing
+    # from the archive get a 404 response, so they fail like on the real API.
+
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        entry = self.archive.next(request.method, request.url)
+        if entry is None:
+            status, reason, headers = 404, "Not Recorded", {"Content-Type": "application/json"}
+            body = dumps({"error": "NotRecorded", "message": f"{request.method} {request.url} is not in the archive"})
+            body = body.encode("utf-8")
+        else:
+            status, reason, headers = entry["status"], entry["reason"], dict(entry["headers"])
+            if "body" in entry:
+                body = entry["body"].encode("utf-8")
+            else:
+                body = base64.b64decode(entry["body_base64"])
+        headers["Content-Length"] = str(len(body))
+
+        raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=status, reason=reason,
+                           preload_content=False, decode_content=False)
+        return self.build_response(request, raw)
+
+
+def replay_session(archive):
+    session = requests.Session()
+    adapter = ReplayAdapter(archive)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
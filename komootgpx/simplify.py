@@ -0,0 +1,60 @@
+import heapq
+import math
+
+EARTH_RADIUS = 6371008.8
+
+
+def simplify_indices(route, tolerance=None, max_points=None):
+    # Ramer-Douglas-Peucker reduction of a Route, returning the ascending indices of the points to keep.
+    # Segments are refined largest deviation first, so the result honours both a distance tolerance
+    # (in meters) and a hard point budget: refinement stops at whichever limit is reached first.
+    n = len(route)
+    if n <= 2 or (tolerance is None and (max_points is None or max_points >= n)):
+        return range(n)
+    if max_points is None:
+        max_points = n
+
+    # equirectangular projection to meters around the route's mean latitude, precise enough for
+    # deviations of a few meters
+    lat0 = math.radians(sum(route.lat) / n)
+    ky = math.pi / 180 * EARTH_RADIUS
+    kx = ky * math.cos(lat0)
+    xs = [lng * kx for lng in route.lng]
+    ys = [lat * ky for lat in route.lat]
+
+    def farthest(first, last):
+        # the point between first and last deviating most from the segment first-last
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        seg_sq = dx * dx + dy * dy
+        best, best_index = -1.0, first
+        for i in range(first + 1, last):
+            px, py = xs[i] - ax, ys[i] - ay
+            if seg_sq > 0:
+                u = (px * dx + py * dy) / seg_sq
+                if u < 0:
+                    u = 0
+                elif u > 1:
+                    u = 1
+                px -= u * dx
+                py -= u * dy
+            dist = px * px + py * py
+            if dist > best:
+                best, best_index = dist, i
+        return math.sqrt(best), best_index
+
+    keep = [0, n - 1]
+    dist, index = farthest(0, n - 1)
+    heap = [(-dist, 0, n - 1, index)]
+    while heap and len(keep) < max_points:
+        neg_dist, first, last, index = heapq.heappop(heap)
+        if tolerance is not None and -neg_dist <= tolerance:
+            break
+        keep.append(index)
+        for a, b in ((first, index), (index, last)):
+            if b - a > 1:
+                dist, split = farthest(a, b)
+                heapq.heappush(heap, (-dist, a, b, split))
+
+    keep.sort()
+    return keep
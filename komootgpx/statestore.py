@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .utils import print_info
+
+
+class StateStore:
+    # Sync state of exported tours in an embedded SQLite database.
+    # Tour records are buffered and written in batches, one transaction per batch,
+    # so a full export does not rewrite the state for every single tour.
+    # Safe to share between threads; SQLite's locking protects concurrent runs.
+
+    BATCH_SIZE = 50
+
+    def __init__(self, path, legacy_hashfile=None):
+        self.path = path
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS tours ("
+                             "tour_id TEXT PRIMARY KEY, changed_at TEXT, changed_hash TEXT, "
+                             "path TEXT, size INTEGER, digest TEXT, updated_at REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            # image manifests are kept per output target (directory or archive), exports to
+            # different targets never see each other's images
+            self._db.execute("CREATE TABLE IF NOT EXISTS tour_images ("
+                             "tour_id TEXT NOT NULL, target TEXT NOT NULL, changed_hash TEXT, updated_at REAL, "
+                             "PRIMARY KEY (tour_id, target))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS images ("
+                             "tour_id TEXT NOT NULL, target TEXT NOT NULL, image_id TEXT NOT NULL, src TEXT, "
+                             "created_at TEXT, path TEXT, digest TEXT, updated_at REAL, "
+                             "PRIMARY KEY (tour_id, target, image_id))")
+
+        if legacy_hashfile and os.path.isfile(legacy_hashfile):
+            self._migrate_hashes(legacy_hashfile)
+
+    # ---------- tours ----------
+
+    def tour(self, tour_id):
+        # Returns the stored record of a tour as dict, or None if it was never exported.
+        tour_id = str(tour_id)
+        with self._lock:
+            if tour_id in self._pending:
+                return dict(self._pending[tour_id])
+            row = self._db.execute("SELECT changed_at, changed_hash, path, size, digest FROM tours WHERE tour_id = ?",
+                                   (tour_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("changed_at", "changed_hash", "path", "size", "digest"), row))
+
+    def record_tour(self, tour_id, changed_at, changed_hash, path, size, digest):
+        with self._lock:
+            self._pending[str(tour_id)] = {"changed_at": changed_at, "changed_hash": changed_hash,
+                                           "path": path, "size": size, "digest": digest}
+            if len(self._pending) >= self.BATCH_SIZE:
+                self._flush()
+
+    # ---------- images ----------
+
+    def images(self, tour_id, target):
+        # Returns (changed_hash, {image_id: record}) of the image manifest of a tour in an output target.
+        # changed_hash is None if the images of the tour were never saved completely.
+        tour_id = str(tour_id)
+        with self._lock:
+            row = self._db.execute("SELECT changed_hash FROM tour_images WHERE tour_id = ? AND target = ?",
+                                   (tour_id, target)).fetchone()
+            rows = self._db.execute("SELECT image_id, src, created_at, path, digest FROM images "
+                                    "WHERE tour_id = ? AND target = ?", (tour_id, target)).fetchall()
+        return (None if row is None else row[0],
+                {r[0]: dict(zip(("src", "created_at", "path", "digest"), r[1:])) for r in rows})
+
+    def record_images(self, tour_id, target, changed_hash, images):
+        # replaces the image manifest of a tour in an output target, written at once since it is recorded once per tour
+        tour_id = str(tour_id)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM images WHERE tour_id = ? AND target = ?", (tour_id, target))
+            self._db.executemany("INSERT INTO images (tour_id, target, image_id, src, created_at, path, digest, "
+                                 "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [(tour_id, target, str(image_id), r["src"], r["created_at"], r["path"], r["digest"],
+                                   now) for image_id, r in images.items()])
+            self._db.execute("INSERT OR REPLACE INTO tour_images (tour_id, target, changed_hash, updated_at) "
+                             "VALUES (?, ?, ?, ?)", (tour_id, target, changed_hash, now))
+
+    # ---------- metadata ----------
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, key, value):
+        # pending tours are committed first, metadata must never be ahead of them
+        with self._lock:
+            self._flush()
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # ---------- lifecycle ----------
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        now = time.time()
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO tours "
+                                 "(tour_id, changed_at, changed_hash, path, size, digest, updated_at) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 [(tour_id, r["changed_at"], r["changed_hash"], r["path"], r["size"], r["digest"], now)
+                                  for tour_id, r in self._pending.items()])
+        self._pending.clear()
+
+    # ---------- migration ----------
+
+    def _migrate_hashes(self, hashfile):
+        with open(hashfile, "r", encoding="utf-8") as f:
+            hashes = json.load(f)
+        with self._db:
+            # records written by this store are newer than the legacy file, keep them
+            self._db.executemany("INSERT OR IGNORE INTO tours (tour_id, changed_hash, updated_at) VALUES (?, ?, ?)",
+                                 [(str(tour_id), tour_hash, time.time()) for tour_id, tour_hash in hashes.items()])
+        os.unlink(hashfile)
+        print_info(f"Migrated {len(hashes)} tour hashes from '{hashfile}' to '{self.path}'")
+
@@ -1,5 +1,7 @@
 import getpass
+import hashlib
 import re
+import threading
 from datetime import datetime, timezone
 
 class bcolor:
@@ -18,17 +20,24 @@ def boolToColorStr(b):
     else:
         return bcolor.FAIL + "false" + bcolor.ENDC
 
+_print_lock = threading.Lock()
+
+def print_line(text):
+    # plain print() of a line, as one write under a lock so lines printed from worker threads don't interleave
+    with _print_lock:
+        print(text + "\n", end="")
+
 def print_error(text):
-    print(bcolor.FAIL + text + bcolor.ENDC)
+    print_line(bcolor.FAIL + text + bcolor.ENDC)
 
 def print_success(text):
-    print(bcolor.OKGREEN + text + bcolor.ENDC)
+    print_line(bcolor.OKGREEN + text + bcolor.ENDC)
 
 def print_warning(text):
-    print(bcolor.WARNING + text + bcolor.ENDC)
+    print_line(bcolor.WARNING + text + bcolor.ENDC)
 
 def print_info(text):
-    print(bcolor.OKBLUE + text + bcolor.ENDC)
+    print_line(bcolor.OKBLUE + text + bcolor.ENDC)
 
 def prompt(title):
     print()
@@ -88,3 +97,24 @@ def parse_date_str(date_str):
     # Handles ISO 8601 with 'Z' suffix
     # python 3.11 has datetime.fromisoformat() with support of Z
     return datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+
+def file_digest(path):
+    # SHA-256 of a file, as recorded by HashingWriter
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class HashingWriter:
+    # Wraps a file and keeps a SHA-256 digest of everything written through it (text is UTF-8 encoded)
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def write(self, data):
+        self.sha.update(data.encode("utf-8") if isinstance(data, str) else data)
+        return self.f.write(data)
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from komootgpx.analytics import MANIFEST, AnalyticsDataset
+
+
+def tour(tour_id, date, changed_at, points):
+    items = [{"lat": 47.0 + i / 1000, "lng": 11.0, "alt": 600.0 + i, "t": i * 1000} for i in range(points)]
+    return {"id": tour_id, "name": f"Tour {tour_id}", "type": "tour_recorded", "sport": "hike", "status": "private",
+            "date": date, "changed_at": changed_at, "distance": 1000.0, "duration": 600.0,
+            "elevation_up": 10.0, "elevation_down": 10.0, "_embedded": {"coordinates": {"items": items}}}
+
+
+def read(root, table):
+    rows = {}
+    for path in sorted((root / table).rglob("*.parquet")):
+        for row in pq.read_table(path, partitioning=None).to_pylist():
+            rows.setdefault((path.parent.name, row["tour_id"]), []).append(row)
+    return rows
+
+
+def test_incremental_update(tmp_path):
+    dataset = AnalyticsDataset(str(tmp_path))
+    dataset.add(tour(1, "2023-06-01T10:00:00.000+02:00", "2023-06-01T12:00:00.000Z", 3))
+    dataset.add(tour(2, "2023-07-01T10:00:00.000+02:00", "2023-07-01T12:00:00.000Z", 2))
+    dataset.add(tour(3, "2024-01-05T10:00:00.000+01:00", "2024-01-05T12:00:00.000Z", 4))
+    dataset.close()
+    assert dataset.written == 3
+    assert sorted(p.name for p in (tmp_path / "tours").iterdir()) == ["year=2023", "year=2024"]
+    parts_2024 = set((tmp_path / "points" / "year=2024").iterdir())
+
+    # tour 1 changed, tour 2 deleted, tour 3 as it was
+    dataset = AnalyticsDataset(str(tmp_path))
+    assert dataset.is_current(3, "2024-01-05T12:00:00.000Z")
+    assert not dataset.is_current(1, "2023-06-02T12:00:00.000Z")
+    dataset.add(tour(1, "2023-06-01T10:00:00.000+02:00", "2023-06-02T12:00:00.000Z", 5))
+    dataset.retain([1, 3])
+    dataset.close()
+    assert (dataset.written, dataset.removed) == (1, 1)
+
+    tours = read(tmp_path, "tours")
+    assert sorted(tours) == [("year=2023", 1), ("year=2024", 3)]
+    assert tours[("year=2023", 1)][0]["points"] == 5
+    points = read(tmp_path, "points")
+    assert [row["index"] for row in points[("year=2023", 1)]] == [0, 1, 2, 3, 4]
+    assert len(points[("year=2024", 3)]) == 4
+    # the untouched partition is kept as it was
+    assert set((tmp_path / "points" / "year=2024").iterdir()) == parts_2024
+
+    with open(tmp_path / MANIFEST, encoding="utf-8") as f:
+        parts = json.load(f)["parts"]
+    assert {tour_id: stamp for tours in parts.values() for tour_id, stamp in tours.items()} == {
+        "1": "2023-06-02T12:00:00.000Z", "3": "2024-01-05T12:00:00.000Z"}
+    assert {part.split("/")[0] for part in parts} == {"year=2023", "year=2024"}
+    for table in ("tours", "points"):
+        assert sorted(str(p.relative_to(tmp_path / table)) for p in (tmp_path / table).rglob("*.parquet")) == \
+            sorted(parts)
@@ -0,0 +1,83 @@
+import tarfile
+import zipfile
+
+import pytest
+
+from komootgpx import output
+from komootgpx.output import ArchiveOutput
+
+
+def write_archive(archive, names):
+    out = ArchiveOutput(archive)
+    for name in names:
+        with out.write_text(out.path(name), 1700000000) as f:
+            f.write(name)
+    out.close()
+
+
+def member_names(archive):
+    if archive.endswith(".zip"):
+        with zipfile.ZipFile(archive) as zf:
+            return sorted(zf.namelist())
+    with tarfile.open(archive) as tf:
+        return sorted(tf.getnames())
+
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar"])
+def test_append(tmp_path, suffix):
+    archive = str(tmp_path / ("tours" + suffix))
+    write_archive(archive, ["a.gpx"])
+    write_archive(archive, ["b.gpx"])
+    assert member_names(archive) == ["a.gpx", "b.gpx"]
+    assert not (tmp_path / ("tours" + suffix + ".journal")).exists()
+
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar"])
+def test_failed_append_is_rolled_back(tmp_path, monkeypatch, suffix):
+    archive = str(tmp_path / ("tours" + suffix))
+    write_archive(archive, ["a.gpx", "b.gpx"])
+    before = open(archive, "rb").read()
+
+    # the first new member is written, the second fails
+    def failing(write):
+        def fail(*args):
+            if fail.calls:
+                raise OSError("disk full")
+            fail.calls += 1
+            write(*args)
+        fail.calls = 0
+        return fail
+
+    out = ArchiveOutput(archive)
+    for name in ("c.gpx", "d.gpx"):
+        with out.write_text(out.path(name), 1700000000) as f:
+            f.write(name)
+    monkeypatch.setattr(output, "_copy_zip_member", failing(output._copy_zip_member))
+    monkeypatch.setattr(tarfile.TarFile, "addfile", failing(tarfile.TarFile.addfile))
+    with pytest.raises(OSError):
+        out.close()
+    assert open(archive, "rb").read() == before
+
+
+@pytest.mark.parametrize("suffix", [".zip", ".tar"])
+def test_interrupted_append_is_rolled_back(tmp_path, suffix):
+    archive = str(tmp_path / ("tours" + suffix))
+    write_archive(archive, ["a.gpx", "b.gpx"])
+    before = open(archive, "rb").read()
+
+    # a crash halfway through an append: the journal is written, the end of the archive overwritten
+    if suffix == ".zip":
+        with zipfile.ZipFile(archive) as zf:
+            offset = zf.start_dir
+    else:
+        with tarfile.open(archive) as tf:
+            offset = tf.getmembers()[-1].offset_data + 512
+    output._write_journal(archive, offset)
+    with open(archive, "rb+") as f:
+        f.seek(offset)
+        f.write(b"\0partial member" * 100)
+
+    out = ArchiveOutput(archive)
+    assert sorted(out.listdir()) == ["a.gpx", "b.gpx"]
+    out.close()
+    assert open(archive, "rb").read() == before
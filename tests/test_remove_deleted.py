@@ -0,0 +1,77 @@
+import hashlib
+
+import pytest
+
+from komootgpx import imagedownload
+from komootgpx.komootgpx import RunConfig, download_tour_images
+from komootgpx.metrics import Metrics
+from komootgpx.output import DirectoryOutput
+from komootgpx.statestore import StateStore
+
+TOUR = {"name": "Tour", "date": "2024-05-01T08:00:00.000+02:00", "changed_at": "2024-05-02T08:00:00.000Z"}
+
+
+def image(image_id, second):
+    return {"id": image_id, "src": f"https://img.example/{image_id}.jpg",
+            "created_at": f"2024-05-01T10:00:0{second}.000Z", "_embedded": {"creator": {"display_name": "Me"}}}
+
+
+class FakeApi:
+    display_name = "Me"
+
+    def __init__(self):
+        self.images = {}
+
+    def fetch_tour_images(self, tour_id, silent=False):
+        return dict(self.images)
+
+
+class FakeDownloader:
+    # saves the image id as the image, instead of downloading it
+    def __init__(self, image, *args, **kwargs):
+        self.image = image
+        self.digest = None
+
+    def download_and_save(self, output_path, process_pool=None, existing=None):
+        data = str(self.image["id"]).encode()
+        with open(output_path, "wb") as f:
+            f.write(data)
+        self.digest = hashlib.sha256(data).hexdigest()
+        return output_path
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    monkeypatch.setattr(imagedownload, "ImageDownloaderWithExif", FakeDownloader)
+    state = StateStore(":memory:")
+    yield RunConfig(api=FakeApi(), state=state, output=DirectoryOutput(str(tmp_path)), analytics=None,
+                    filename_pattern="{id}.gpx", image_dir_pattern="{id}_images", no_poi=False,
+                    skip_existing=False, skip_unchanged=False, remove_deleted=True, max_title_length=-1,
+                    max_desc_length=-1, all_images=False, language="en", karoo=False, highlight_jobs=1,
+                    simplify=None, max_points=None, image_jobs=1, max_image_size=None, image_pool=None,
+                    metrics=Metrics())
+    state.close()
+
+
+def test_remove_deleted_keeps_locally_modified_images(cfg, tmp_path):
+    cfg.api.images = {1: image(1, 1), 2: image(2, 2), 3: image(3, 3)}
+    assert download_tour_images(cfg, 7, TOUR)
+    image_dir = tmp_path / "7_images"
+    modified = image_dir / "20240501-100002-hl2.jpg"
+    modified.write_bytes(b"edited locally")
+
+    # images 2 and 3 are deleted in Komoot, only the unmodified one is removed
+    cfg.api.images = {1: image(1, 1)}
+    assert download_tour_images(cfg, 7, TOUR)
+    assert sorted(f.name for f in image_dir.iterdir()) == ["20240501-100001-hl1.jpg", "20240501-100002-hl2.jpg"]
+    assert modified.read_bytes() == b"edited locally"
+
+
+def test_remove_deleted_removes_unknown_files(cfg, tmp_path):
+    cfg.api.images = {1: image(1, 1)}
+    assert download_tour_images(cfg, 7, TOUR)
+    # e.g. saved by a version without image manifests
+    (tmp_path / "7_images" / "20240101-000000-hl9.jpg").write_bytes(b"old")
+
+    assert download_tour_images(cfg, 7, TOUR)
+    assert [f.name for f in (tmp_path / "7_images").iterdir()] == ["20240501-100001-hl1.jpg"]